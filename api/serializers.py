@@ -80,7 +80,17 @@ class ProviderRegistrationSerializer(ShareModelSerializer):
         fields = '__all__'
 
 
-class FullNormalizedDataSerializer(serializers.ModelSerializer):
+class NormalizedDataSerializer(serializers.ModelSerializer):
+
+    def create(self, validated_data):
+        # Identical resubmissions reuse the last NormalizedData, see NormalizedDataManager.store
+        tasks = validated_data.pop('tasks', ())
+        instance = models.NormalizedData.objects.store(**validated_data)
+        instance.tasks.add(*tasks)
+        return instance
+
+
+class FullNormalizedDataSerializer(NormalizedDataSerializer):
 
     tasks = serializers.PrimaryKeyRelatedField(many=True, read_only=False, queryset=CeleryProviderTask.objects.all())
     source = serializers.HiddenField(default=serializers.CurrentUserDefault())
@@ -90,7 +100,7 @@ class FullNormalizedDataSerializer(serializers.ModelSerializer):
         fields = ('data', 'source', 'raw', 'tasks')
 
 
-class BasicNormalizedDataSerializer(serializers.ModelSerializer):
+class BasicNormalizedDataSerializer(NormalizedDataSerializer):
 
     source = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
@@ -5,6 +5,7 @@ from django.conf import settings
 from elasticsearch import Elasticsearch
 
 from bots.elasticsearch.tasks import IndexModelTask
+from bots.elasticsearch.tasks import IndexQueueTask
 from bots.elasticsearch.tasks import IndexSourceTask
 from share.bot import Bot
 
@@ -166,6 +167,20 @@ class ElasticSearchBot(Bot):
         else:
             logger.debug('Skipping ES setup')
 
+        if self.es_filter:
+            self.index_filtered(self.es_filter, chunk_size)
+        elif self._last_run is not None:
+            # An explicit last run reindexes everything modified since, the queue only holds what changed after it was created
+            self.index_filtered({'date_modified__gt': self.last_run}, chunk_size)
+        else:
+            # Changes are captured by triggers, see bots.elasticsearch.models.IndexQueueEntry
+            logger.info('Starting task to index the queue of changed objects')
+            IndexQueueTask().apply_async((self.started_by.id, self.config.label), {'es_url': self.es_url, 'es_index': self.es_index, 'batch_size': chunk_size, 'model_names': self.es_models})
+
+        logger.info('Starting task to index sources')
+        IndexSourceTask().apply_async((self.started_by.id, self.config.label), {'es_url': self.es_url, 'es_index': self.es_index})
+
+    def index_filtered(self, es_filter, chunk_size):
         logger.info('Loading up indexed models')
         for model_name in self.config.INDEX_MODELS:
             if self.es_models and model_name.lower() not in self.es_models:
@@ -173,12 +188,8 @@ class ElasticSearchBot(Bot):
 
             model = apps.get_model('share', model_name)
 
-            if self.es_filter:
-                logger.info('Looking for %ss that match %s', model, self.es_filter)
-                qs = model.objects.filter(**self.es_filter).values_list('id', flat=True)
-            else:
-                logger.info('Looking for %ss that have been modified after %s', model, self.last_run)
-                qs = model.objects.filter(date_modified__gt=self.last_run).values_list('id', flat=True)
+            logger.info('Looking for %ss that match %s', model, es_filter)
+            qs = model.objects.filter(**es_filter).values_list('id', flat=True)
 
             count = qs.count()
 
@@ -192,9 +203,6 @@ class ElasticSearchBot(Bot):
                 if batch:
                     IndexModelTask().apply_async((self.started_by.id, self.config.label, model.__name__, batch,), {'es_url': self.es_url, 'es_index': self.es_index})
 
-        logger.info('Starting task to index sources')
-        IndexSourceTask().apply_async((self.started_by.id, self.config.label), {'es_url': self.es_url, 'es_index': self.es_index})
-
     def setup(self):
         logger.debug('Ensuring Elasticsearch index %s', self.es_index)
         self.es_client.indices.create(self.es_index, ignore=400)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# For every table an Elasticsearch document is built from, the documents that must be reindexed when one of its rows is written.
+# (model name, SELECT of the affected ids, condition or None)
+# Contributor and affiliation names are copied into creative works, so renaming an agent requeues all of its works.
+DEPENDENTS = {
+    'share_creativework': [
+        ('creativework', 'SELECT NEW.id', None),
+        # Retractions are part of the retracted work's document
+        ('creativework', 'SELECT related_id FROM share_workrelation WHERE subject_id = NEW.id', None),
+    ],
+    'share_creativework_sources': [
+        ('creativework', 'SELECT NEW.abstractcreativework_id', None),
+    ],
+    'share_workidentifier': [
+        ('creativework', 'SELECT NEW.creative_work_id', None),
+        ('creativework', 'SELECT related_id FROM share_workrelation WHERE subject_id = NEW.creative_work_id', None),
+    ],
+    'share_workrelation': [
+        ('creativework', 'SELECT NEW.related_id', None),
+    ],
+    'share_throughtags': [
+        ('creativework', 'SELECT NEW.creative_work_id', None),
+    ],
+    'share_throughsubjects': [
+        ('creativework', 'SELECT NEW.creative_work_id', None),
+    ],
+    'share_tag': [
+        ('tag', 'SELECT NEW.id', None),
+    ],
+    'share_agent': [
+        ('agent', 'SELECT NEW.id', None),
+        (
+            'creativework',
+            'SELECT creative_work_id FROM share_agentworkrelation WHERE agent_id = NEW.id',
+            'OLD.name IS DISTINCT FROM NEW.name OR OLD.type IS DISTINCT FROM NEW.type',
+        ),
+        (
+            'creativework',
+            'SELECT relation.creative_work_id FROM share_agentrelation AS affiliation JOIN share_agentworkrelation AS relation ON relation.agent_id = affiliation.subject_id WHERE affiliation.related_id = NEW.id',
+            'OLD.name IS DISTINCT FROM NEW.name OR OLD.type IS DISTINCT FROM NEW.type',
+        ),
+    ],
+    'share_agent_sources': [
+        ('agent', 'SELECT NEW.abstractagent_id', None),
+    ],
+    'share_agentidentifier': [
+        ('agent', 'SELECT NEW.agent_id', None),
+        ('creativework', 'SELECT creative_work_id FROM share_agentworkrelation WHERE agent_id = NEW.agent_id', None),
+    ],
+    'share_agentworkrelation': [
+        ('agent', 'SELECT NEW.agent_id', None),
+        ('creativework', 'SELECT NEW.creative_work_id', None),
+    ],
+    'share_agentrelation': [
+        ('creativework', 'SELECT creative_work_id FROM share_agentworkrelation WHERE agent_id = NEW.subject_id', None),
+    ],
+    'share_throughawards': [
+        ('creativework', 'SELECT creative_work_id FROM share_agentworkrelation WHERE id = NEW.funder_id', None),
+    ],
+    'share_award': [
+        ('creativework', 'SELECT relation.creative_work_id FROM share_throughawards AS throughaward JOIN share_agentworkrelation AS relation ON throughaward.funder_id = relation.id WHERE throughaward.award_id = NEW.id', None),
+    ],
+}
+
+
+def enqueue(model_name, select, condition):
+    # The queue is append only, without a unique index concurrent writers never wait on each other.
+    # Duplicates are removed when the queue is drained.
+    sql = '''
+            INSERT INTO elasticsearch_indexqueueentry (model_name, object_id)
+                SELECT DISTINCT '{}'::text, ids.id FROM ({}) AS ids(id) WHERE ids.id IS NOT NULL;'''.format(model_name, select)
+    if condition is None:
+        return sql
+    # OLD is not assigned on INSERT, nothing depends on a row that has only just been created
+    return '''
+            IF TG_OP = 'UPDATE' THEN IF {} THEN{}
+            END IF; END IF;'''.format(condition, sql)
+
+
+def create_trigger(table, dependents):
+    return '''
+        CREATE OR REPLACE FUNCTION elasticsearch_enqueue_{0}() RETURNS trigger AS $$
+        BEGIN{1}
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS elasticsearch_enqueue_{0} ON {0};
+        CREATE TRIGGER elasticsearch_enqueue_{0} AFTER INSERT OR UPDATE ON {0}
+            FOR EACH ROW EXECUTE PROCEDURE elasticsearch_enqueue_{0}();
+    '''.format(table, ''.join(enqueue(*dependent) for dependent in dependents))
+
+
+def drop_trigger(table):
+    return '''
+        DROP TRIGGER IF EXISTS elasticsearch_enqueue_{0} ON {0};
+        DROP FUNCTION IF EXISTS elasticsearch_enqueue_{0}();
+    '''.format(table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elasticsearch', '0001_initial'),
+        ('share', '0032_version_persistent_id_date_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexQueueEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.TextField()),
+                ('object_id', models.IntegerField()),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='indexqueueentry',
+            index_together=set([('model_name', 'object_id')]),
+        ),
+    ] + [
+        migrations.RunSQL(create_trigger(table, dependents), reverse_sql=drop_trigger(table))
+        for table, dependents in sorted(DEPENDENTS.items())
+    ]
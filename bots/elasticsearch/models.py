@@ -0,0 +1,76 @@
+from django.db import connection
+from django.db import models
+from django.db import transaction
+
+
+class IndexQueueManager(models.Manager):
+
+    # Takes up to size of the oldest entries, along with every other entry for the same objects.
+    # Entries locked by another transaction are skipped, so any number of indexers may drain the queue at once.
+    CLAIM_QUERY = '''
+        WITH batch AS (
+            SELECT id, model_name, object_id FROM "{table}"
+            WHERE id <= %(last)s {models}
+            ORDER BY id
+            LIMIT %(size)s
+            FOR UPDATE SKIP LOCKED
+        ), duplicates AS (
+            SELECT queue.id FROM "{table}" AS queue
+            JOIN (SELECT DISTINCT model_name, object_id FROM batch) AS claimed USING (model_name, object_id)
+            FOR UPDATE OF queue SKIP LOCKED
+        )
+        DELETE FROM "{table}"
+        WHERE id IN (SELECT id FROM batch UNION SELECT id FROM duplicates)
+        RETURNING model_name, object_id;
+    '''
+
+    def last_id(self):
+        """The id of the newest entry, entries added after it are left for the next run.
+        """
+        return self.aggregate(last=models.Max('id'))['last'] or 0
+
+    def claim(self, size, last, model_names=None):
+        """Remove up to size of the oldest entries, no newer than last, from the queue and commit.
+
+        Returns a dict of model names to distinct object ids. The caller owns them from then on,
+        see requeue for putting them back.
+        """
+        query = self.CLAIM_QUERY.format(
+            table=self.model._meta.db_table,
+            models='AND model_name = ANY(%(model_names)s)' if model_names else '',
+        )
+
+        claimed = {}
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(query, {'last': last, 'size': size, 'model_names': model_names})
+            for model_name, object_id in cursor.fetchall():
+                claimed.setdefault(model_name, set()).add(object_id)
+
+        return {model_name: sorted(ids) for model_name, ids in claimed.items()}
+
+    def requeue(self, claimed):
+        """Put objects returned by claim back into the queue.
+        """
+        self.bulk_create([
+            self.model(model_name=model_name, object_id=object_id)
+            for model_name, ids in sorted(claimed.items())
+            for object_id in ids
+        ])
+
+
+class IndexQueueEntry(models.Model):
+    """An object whose Elasticsearch document is out of date.
+
+    Entries are added by database triggers, see migration 0002, whenever an indexed object or anything its document is
+    built from is written. An object may be queued more than once, claim removes all of its entries together.
+    """
+    model_name = models.TextField()
+    object_id = models.IntegerField()
+
+    objects = IndexQueueManager()
+
+    class Meta:
+        index_together = ('model_name', 'object_id')
+
+    def __str__(self):
+        return '{}: {}'.format(self.model_name, self.object_id)
@@ -15,6 +15,7 @@ from share.tasks import AppTask
 from share.util import IDObfuscator
 
 from bots.elasticsearch import util
+from bots.elasticsearch.models import IndexQueueEntry
 
 
 logger = logging.getLogger(__name__)
@@ -34,6 +35,8 @@ def score_text(text):
 
 
 class IndexModelTask(AppTask):
+    # The number of ids fetched from the database at once
+    SHARD_SIZE = 100
 
     def do_run(self, model_name, ids, es_url=None, es_index=None):
         errors = []
@@ -58,8 +61,11 @@ class IndexModelTask(AppTask):
 
         opts = {'_index': es_index, '_type': model._meta.verbose_name_plural.replace(' ', '')}
 
+        # Fetch the next shard of ids while the current one is being sent to elasticsearch
+        shards = util.shards(ids, self.SHARD_SIZE)
+
         if model is CreativeWork:
-            for blob in util.fetch_creativework(ids):
+            for blob in util.pipelined(util.fetch_creativework, shards):
                 if blob.pop('is_deleted'):
                     yield {'_id': blob['id'], '_op_type': 'delete', **opts}
                 else:
@@ -67,7 +73,7 @@ class IndexModelTask(AppTask):
             return
 
         if model is Agent:
-            for blob in util.fetch_agent(ids):
+            for blob in util.pipelined(util.fetch_agent, shards):
                 yield {'_id': blob['id'], '_op_type': 'index', **blob, **opts}
             return
 
@@ -97,6 +103,39 @@ class IndexModelTask(AppTask):
         }
 
 
+class IndexQueueTask(AppTask):
+    """Reindex everything in the IndexQueueEntry queue, batch_size entries at a time.
+
+    Each batch is claimed and committed in a short transaction of its own and indexed outside of it, so no locks are
+    held while talking to Elasticsearch. A batch that fails to index is put back in the queue for the next run.
+    Any number of these tasks may run at once, each claims batches the others have not locked.
+    """
+
+    def do_run(self, es_url=None, es_index=None, batch_size=500, model_names=None):
+        indexer = IndexModelTask()
+        failed = []
+
+        # Requeued batches land after this, so they are not retried until the next run
+        last = IndexQueueEntry.objects.last_id()
+
+        while True:
+            claimed = IndexQueueEntry.objects.claim(batch_size, last, model_names=model_names)
+            if not claimed:
+                break
+
+            try:
+                for model_name, ids in claimed.items():
+                    logger.debug('Indexing %d %ss from the queue', len(ids), model_name)
+                    indexer.do_run(model_name, ids, es_url=es_url, es_index=es_index)
+            except Exception as e:
+                logger.exception('Failed to index a batch from the queue')
+                IndexQueueEntry.objects.requeue(claimed)
+                failed.append(e)
+
+        if failed:
+            raise Exception('Failed to index {} batches from the queue {}'.format(len(failed), failed))
+
+
 class IndexSourceTask(AppTask):
 
     def do_run(self, es_url=None, es_index=None):
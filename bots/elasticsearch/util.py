@@ -1,5 +1,10 @@
 import uuid
+import queue
+import threading
+
 import bleach
+import ujson
+from psycopg2.extras import register_default_json
 
 from django.apps import apps
 from django.db import connection
@@ -9,6 +14,11 @@ from project.settings import ALLOWED_TAGS
 
 from share import models
 from share.util import IDObfuscator
+from share.util import SubjectTaxonomy
+
+
+# Rows fetched per round trip by the named cursors below
+FETCH_SIZE = 100
 
 
 def sql_to_dict(keys, values):
@@ -38,12 +48,78 @@ def populate_types(data):
     return data
 
 
+def streaming_cursor(name):
+    # A named, server side, cursor that fetches FETCH_SIZE rows at a time when iterated
+    # JSON rows are decoded with ujson rather than the json module
+    cursor = connection.connection.cursor(name)
+    cursor.itersize = FETCH_SIZE
+    register_default_json(cursor, loads=ujson.loads)
+    return cursor
+
+
+def shards(pks, size):
+    """Split pks into id ranges of at most size ids each, in ascending order.
+    """
+    pks = sorted(pks)
+    return [pks[i:i + size] for i in range(0, len(pks), size)]
+
+
+def pipelined(fetch, shards):
+    """Yield everything fetch yields for each shard in turn.
+
+    Shards are fetched by a background thread, on its own connection, so the next shard is being fetched while the caller
+    consumes the current one. Other connections cannot see uncommitted rows, so inside a transaction shards are fetched
+    one after the other on the calling thread instead.
+    """
+    if len(shards) < 2 or connection.in_atomic_block:
+        for shard in shards:
+            yield from fetch(shard)
+        return
+
+    fetched = queue.Queue(maxsize=1)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                return fetched.put(item, timeout=1)
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for shard in shards:
+                if stopped.is_set():
+                    return
+                put(list(fetch(shard)))
+            put(None)
+        except Exception as e:
+            put(e)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = fetched.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+    finally:
+        stopped.set()
+        thread.join()
+
+
 def fetch_agent(pks):
     if connection.connection is None:
         connection.cursor()
 
     with transaction.atomic():
-        with connection.connection.cursor(str(uuid.uuid4())) as c:
+        with streaming_cursor(str(uuid.uuid4())) as c:
             c.execute('''
                 SELECT json_strip_nulls(json_build_object(
                                             'id', agent.id
@@ -80,13 +156,7 @@ def fetch_agent(pks):
                 WHERE agent.id in %s
             ''', (tuple(pks), ))
 
-            while True:
-                data = c.fetchone()
-
-                if not data:
-                    return
-
-                data = data[0]
+            for (data, ) in c:
                 populate_types(data)
 
                 for rtype in data.pop('related_types'):
@@ -104,7 +174,7 @@ def fetch_creativework(pks):
         connection.cursor()
 
     with transaction.atomic():
-        with connection.connection.cursor(str(uuid.uuid4())) as c:
+        with streaming_cursor(str(uuid.uuid4())) as c:
             c.execute('''
                 SELECT json_build_object(
                     'id', creativework.id
@@ -199,18 +269,10 @@ def fetch_creativework(pks):
                             WHERE throughtag.creative_work_id = creativework.id
                             ) AS tags ON TRUE
                 LEFT JOIN LATERAL (
-                            SELECT array_agg(DISTINCT name) AS subjects
-                            FROM (
-                                SELECT unnest(ARRAY [child.name, parent.name, grand_parent.name, great_grand_parent.name])
-                                FROM share_subject AS child
-                                    LEFT JOIN share_subject AS parent ON child.parent_id = parent.id
-                                    LEFT JOIN share_subject AS grand_parent ON parent.parent_id = grand_parent.id
-                                    LEFT JOIN share_subject AS great_grand_parent ON grand_parent.parent_id = great_grand_parent.id
-                                WHERE child.id IN (SELECT share_throughsubjects.subject_id
-                                                    FROM share_throughsubjects
-                                                    WHERE share_throughsubjects.creative_work_id = creativework.id)
-                                ) AS x(name)
-                            WHERE name IS NOT NULL
+                            SELECT array_agg(DISTINCT subject.name) AS subjects
+                            FROM share_throughsubjects AS throughsubject
+                            JOIN share_subject AS subject ON throughsubject.subject_id = subject.id
+                            WHERE throughsubject.creative_work_id = creativework.id
                             ) AS subjects ON TRUE
                 LEFT JOIN LATERAL (
                             SELECT json_agg(json_strip_nulls(json_build_object(
@@ -239,14 +301,10 @@ def fetch_creativework(pks):
                 AND creativework.title != ''
             ''', (tuple(pks), ))
 
-            while True:
-                data = c.fetchone()
-
-                if not data:
-                    return
-
-                data = data[0]
+            for (data, ) in c:
                 data['lists'] = {}
+                # Ancestors are expanded here rather than with a chain of self joins per work
+                data['subjects'] = SubjectTaxonomy.expand(data['subjects'])
 
                 if data['description']:
                     data['description'] = bleach.clean(data['description'], strip=True, tags=ALLOWED_TAGS)
@@ -365,7 +365,7 @@ QUEUES = {
     'MED': {
         'name': 'med',
         'priority': 20,
-        'modules': {'share.tasks.DisambiguatorTask', },
+        'modules': {'share.tasks.DisambiguatorTask', 'share.tasks.BatchDisambiguatorTask', },
     },
     'HIGH': {
         'name': 'high',
@@ -479,6 +479,14 @@ SHARE_WEB_URL = os.environ.get('SHARE_WEB_URL', SHARE_API_URL + EMBER_SHARE_PREF
 OSF_API_URL = os.environ.get('OSF_API_URL', 'https://staging-api.osf.io').rstrip('/') + '/'
 DOI_BASE_URL = os.environ.get('DOI_BASE_URL', 'http://dx.doi.org/')
 
+# Max number of disambiguation keys each worker remembers, 0 to disable
+SHARE_DISAMBIGUATION_CACHE_SIZE = int(os.environ.get('SHARE_DISAMBIGUATION_CACHE_SIZE', 10000))
+
+# History older than this many days may be removed by the compactversions command.
+# The latest SHARE_VERSION_RETENTION_KEEP versions of every object are always kept
+SHARE_VERSION_RETENTION_DAYS = int(os.environ.get('SHARE_VERSION_RETENTION_DAYS', 365))
+SHARE_VERSION_RETENTION_KEEP = int(os.environ.get('SHARE_VERSION_RETENTION_KEEP', 10))
+
 ALLOWED_TAGS = ['abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'strong', 'ul']
 
 # API KEYS
@@ -1,6 +1,7 @@
 from django.apps import AppConfig
 from django.db.models.signals import post_migrate
 from share.signals import post_migrate_load_sources
+from share.signals import post_migrate_clear_caches
 
 
 class ShareConfig(AppConfig):
@@ -8,3 +9,4 @@ class ShareConfig(AppConfig):
 
     def ready(self):
         post_migrate.connect(post_migrate_load_sources, sender=self)
+        post_migrate.connect(post_migrate_clear_caches)
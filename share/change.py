@@ -1,5 +1,7 @@
+import sys
 import uuid
 import copy
+import types
 import logging
 import pendulum
 import datetime
@@ -8,12 +10,18 @@ from django.apps import apps
 from django.core.exceptions import FieldDoesNotExist
 
 from share.disambiguation import GraphDisambiguator
+from share.util import OrderedSet
 from share.util import TopographicalSorter
 from share.util import IDObfuscator
+from share.util import ModelInfo
 
 
 logger = logging.getLogger(__name__)
 
+# Shared, read only stand-ins for the containers most nodes never fill
+EMPTY_EDGES = frozenset()
+EMPTY_MAPPING = types.MappingProxyType({})
+
 
 class GraphParsingException(Exception):
     pass
@@ -24,21 +32,33 @@ class UnresolvableReference(GraphParsingException):
 
 
 class GraphEdge:
+    __slots__ = ('subject', 'related', '_hint')
+
+    # (subject model, concrete related model, hint) -> field
+    # Shared by every edge in the process, model relations never change at runtime
+    _field_cache = {}
+
+    @classmethod
+    def field_for(cls, subject_model, related_model, hint=None):
+        key = (subject_model, related_model, hint)
+        try:
+            return cls._field_cache[key]
+        except KeyError:
+            pass
 
-    # TODO Cache
-    @property
-    def field(self):
-        subject_model = self.subject.model
-        related_model = self.related.model._meta.concrete_model
         possible = tuple(
             f for f in subject_model._meta.get_fields()
             if f.is_relation
             and f.related_model is related_model
-            and (not self._hint or f.name == self._hint)
+            and (not hint or f.name == hint)
         )
         assert len(possible) == 1
 
-        return possible[0]
+        return cls._field_cache.setdefault(key, possible[0])
+
+    @property
+    def field(self):
+        return GraphEdge.field_for(self.subject.model, self.related.model._meta.concrete_model, self._hint)
 
     @property
     def remote_field(self):
@@ -70,51 +90,60 @@ class GraphEdge:
 class ChangeGraph:
 
     def __init__(self, data, namespace=None):
-        self.nodes = []
+        self.nodes = OrderedSet()
         self.relations = {}
         self._lookup = {}
         self.namespace = namespace
 
-        hints, relations = {}, set()
-        for blob in copy.deepcopy(data):
-            id, type = blob.pop('@id'), blob.pop('@type').lower()
-
-            self._lookup[id, type] = ChangeNode(self, id, type, blob, namespace=namespace)
-            self.relations[self._lookup[id, type]] = set()
-            self.nodes.append(self._lookup[id, type])
+        # Edge indexes, kept in sync by _add_edge and _remove_edge
+        # Nodes without any edges share EMPTY_EDGES instead of holding their own empty sets
+        # node -> edges where node is the subject
+        self._forward = {}
+        # node -> edges where node is the related
+        self._backward = {}
+        # (node, forward) -> {field name: [edges]}, built lazily by ChangeGraph.edges
+        self._named = {}
+
+        # (subject, related) -> hint
+        # `data` is never mutated, each node gets a shallow copy of its blob without the relation keys
+        relations = {}
+        for blob in data:
+            id, type = blob['@id'], blob['@type'].lower()
 
-            for k, v in tuple(blob.items()):
+            attrs = {}
+            for k, v in blob.items():
+                if k == '@id' or k == '@type':
+                    continue
                 if isinstance(v, dict) and k != 'extra' and not k.startswith('@'):
-                    related = (v.pop('@id'), v.pop('@type').lower())
-                    hints[(id, type), related] = k
-                    relations.add(((id, type), related))
-                    blob.pop(k)
-                if isinstance(v, list):
+                    relations[(id, type), (v['@id'], v['@type'].lower())] = k
+                elif isinstance(v, list):
                     for rel in v:
-                        subject = (rel.pop('@id'), rel.pop('@type').lower())
-                        relations.add((subject, (id, type)))
-                    blob.pop(k)
+                        relations.setdefault(((rel['@id'], rel['@type'].lower()), (id, type)), None)
+                else:
+                    attrs[k] = v
+
+            self.add(ChangeNode(self, id, type, attrs, namespace=namespace))
 
-        for subject, related in relations:
+        self._load_instances(n for n in self.nodes if not n.is_blank)
+
+        for (subject, related), hint in relations.items():
             try:
-                edge = GraphEdge(self._lookup[subject], self._lookup[related], hint=hints.get((subject, related)))
+                edge = GraphEdge(self._lookup[subject], self._lookup[related], hint=hint)
             except KeyError as e:
                 raise UnresolvableReference(*e.args)
 
-            self.relations[self._lookup[subject]].add(edge)
-            self.relations[self._lookup[related]].add(edge)
+            self._add_edge(edge)
 
-        self.nodes = TopographicalSorter(self.nodes, dependencies=lambda n: tuple(e.related for e in n.related(backward=False))).sorted()
+        self._sort()
 
+    # prune and disambiguate may leave nodes out of order, process sorts them once it is done
     def prune(self):
         gd = GraphDisambiguator()
         gd.prune(self)
-        self.nodes = TopographicalSorter(self.nodes, dependencies=lambda n: tuple(e.related for e in n.related(backward=False))).sorted()
 
     def disambiguate(self):
         gd = GraphDisambiguator()
         gd.find_instances(self)
-        self.nodes = TopographicalSorter(self.nodes, dependencies=lambda n: tuple(e.related for e in n.related(backward=False))).sorted()
 
     def normalize(self):
         # Freeze nodes to avoid oddities with inserting and removing nodes
@@ -140,55 +169,57 @@ class ChangeGraph:
         if disambiguate:
             gd.find_instances(self)
 
-        self.nodes = TopographicalSorter(self.nodes, dependencies=lambda n: tuple(e.related for e in n.related(backward=False))).sorted()
+        # ChangeSets are created in node order, so dependencies must come first
+        self._sort()
+
+    def _sort(self):
+        self.nodes = OrderedSet(TopographicalSorter(self.nodes, dependencies=lambda n: (e.related for e in self._forward.get(n, EMPTY_EDGES))).sorted())
 
     def get(self, id, type):
         return self._lookup[(id, type)]
 
     def create(self, id, type, attrs):
-        return self.add(ChangeNode(self, id or '_:{}'.format(uuid.uuid4()), type, attrs, namespace=self.namespace))
+        node = self.add(ChangeNode(self, id or '_:{}'.format(uuid.uuid4()), type, attrs, namespace=self.namespace))
+        if not node.is_blank:
+            self._load_instances((node, ))
+        return node
 
     def add(self, node):
         node.graph = self
-        self.nodes.append(node)
-        self.relations[node] = set()
+        self.nodes.add(node)
+        self.relations[node] = EMPTY_EDGES
         self._lookup[node.id, node.type] = node
         return node
 
     def relate(self, subject, related, hint=None):
         edge = GraphEdge(subject, related, hint)
-        self.relations[subject].add(edge)
-        self.relations[related].add(edge)
+        self._add_edge(edge)
         return edge
 
     def replace(self, source, replacement):
         for edge in tuple(source.related()):
             # NOTE: Order of add & removes matters here due to
             # the hash function of an edge and how sets work
-            self.relations[source].remove(edge)
+            self._remove_edge(edge)
             if edge.subject == source:
-                self.relations[edge.related].remove(edge)
                 edge.subject = replacement
-                self.relations[edge.related].add(edge)
             else:
-                self.relations[edge.subject].remove(edge)
                 edge.related = replacement
-                self.relations[edge.subject].add(edge)
-            self.relations[replacement].add(edge)
+            self._add_edge(edge)
 
         return self.remove(source)
 
     def remove(self, node, cascade=True):
         for edge in tuple(self.relations[node]):
-            if edge.subject is node:
-                self.relations[edge.related].remove(edge)
-            elif cascade:
+            if edge.subject is node or not cascade:
+                self._remove_edge(edge)
+            elif edge.subject in self.relations:
                 self.remove(edge.subject, cascade=True)
-            else:
-                self.relations[edge.subject].remove(edge)
 
         self.nodes.remove(node)
         del self.relations[node]
+        self._forward.pop(node, None)
+        self._backward.pop(node, None)
         try:
             del self._lookup[node.id, node.type]
         except KeyError:
@@ -196,6 +227,103 @@ class ChangeGraph:
             logger.warning('Could not find lookup entry for %s. Falling back to %s', node, key)
             del self._lookup[key]
 
+    def _load_instances(self, nodes):
+        # Resolve concrete references in bulk, one query per model
+        nodes = tuple(nodes)
+        instances = IDObfuscator.load_many(n.id for n in nodes)
+
+        for node in nodes:
+            node.instance = instances.get(node.id)
+            if not node.instance or node.instance._meta.concrete_model is not node.model._meta.concrete_model:
+                raise UnresolvableReference((node.id, node.type))
+
+    def changes(self):
+        """The change of every node that is not skippable, see ChangeNode.change.
+
+        Each node is diffed once. State the diffs need that was not loaded along with the instances is loaded in bulk first.
+        """
+        self._load_extras(n.instance for n in self.nodes if n.instance)
+
+        changes = {}
+        for node in self.nodes:
+            # Attributes and relations may have changed since the node was last diffed
+            node._change = None
+            if not node.is_skippable:
+                changes[node] = node.change
+        return changes
+
+    def _load_extras(self, instances):
+        # Extra data is only diffed for namespaced graphs, see ChangeNode.change
+        if not self.namespace:
+            return
+
+        instances = [
+            inst for inst in instances
+            if getattr(inst, 'extra_id', None) and not hasattr(inst, inst._meta.get_field('extra').get_cache_name())
+        ]
+        extras = apps.get_model('share', 'extradata').objects.in_bulk({inst.extra_id for inst in instances})
+
+        for inst in instances:
+            inst.extra = extras[inst.extra_id]
+
+    def edges(self, node, name=None, forward=True, backward=True):
+        if name is None:
+            if forward and backward:
+                return tuple(self.relations[node])
+            if forward:
+                return tuple(self._forward.get(node, EMPTY_EDGES))
+            if backward:
+                return tuple(self._backward.get(node, EMPTY_EDGES))
+            return ()
+
+        edges = ()
+        if forward:
+            edges += self._edges_named(node, True).get(name, ())
+        if backward:
+            edges += self._edges_named(node, False).get(name, ())
+        return edges
+
+    def _edges_named(self, node, forward):
+        try:
+            return self._named[node, forward]
+        except KeyError:
+            pass
+
+        index = {}
+        if forward:
+            for edge in self._forward.get(node, EMPTY_EDGES):
+                index[edge.name] = index.get(edge.name, ()) + (edge, )
+        else:
+            for edge in self._backward.get(node, EMPTY_EDGES):
+                index[edge.remote_name] = index.get(edge.remote_name, ()) + (edge, )
+
+        return self._named.setdefault((node, forward), index)
+
+    def _add_edge(self, edge):
+        for index, node in ((self.relations, edge.subject), (self.relations, edge.related), (self._forward, edge.subject), (self._backward, edge.related)):
+            edges = index.get(node, EMPTY_EDGES)
+            if edges is EMPTY_EDGES:
+                edges = index[node] = set()
+            edges.add(edge)
+        self._drop_named(edge.subject, edge.related)
+
+    def _remove_edge(self, edge):
+        for index, node in ((self.relations, edge.subject), (self.relations, edge.related), (self._forward, edge.subject), (self._backward, edge.related)):
+            edges = index.get(node)
+            if edges:
+                edges.discard(edge)
+        self._drop_named(edge.subject, edge.related)
+
+    def _drop_named(self, *nodes):
+        for node in nodes:
+            self._named.pop((node, True), None)
+            self._named.pop((node, False), None)
+
+    def _model_changed(self, node):
+        # Edge names are derived from the models on either end of the edge
+        if node in self.relations:
+            self._drop_named(node, *(n for e in self.relations[node] for n in (e.subject, e.related)))
+
     def serialize(self):
         return [
             n.serialize()
@@ -204,6 +332,7 @@ class ChangeGraph:
 
 
 class ChangeNode:
+    __slots__ = ('graph', '_id', '_instance', '_declared_type', '_model', '_resolved_type', '_change', 'attrs', 'extra', 'context', 'namespace')
 
     @property
     def id(self):
@@ -211,10 +340,9 @@ class ChangeNode:
 
     @property
     def type(self):
-        model = apps.get_app_config('share').get_model(self._type)
-        if not self.instance or len(model.mro()) >= len(type(self.instance).mro()):
-            return self._type
-        return self.instance._meta.model_name.lower()
+        if self._resolved_type is None:
+            self._resolve_model()
+        return self._resolved_type
 
     @property
     def ref(self):
@@ -222,15 +350,46 @@ class ChangeNode:
 
     @property
     def model(self):
-        model = apps.get_model('share', self._type)
-        if not self.instance or len(model.mro()) >= len(type(self.instance).mro()):
-            return model
+        if self._model is None:
+            self._resolve_model()
+        return self._model
+
+    # model and type are cached on the node, these setters are the only way they may be invalidated
+    @property
+    def _type(self):
+        return self._declared_type
+
+    @_type.setter
+    def _type(self, value):
+        self._declared_type = sys.intern(value)
+        self._model = self._resolved_type = self._change = None
+        self.graph._model_changed(self)
+
+    @property
+    def instance(self):
+        return self._instance
+
+    @instance.setter
+    def instance(self, value):
+        self._instance = value
+        self._model = self._resolved_type = self._change = None
+        self.graph._model_changed(self)
+
+    def _resolve_model(self):
+        info = ModelInfo.for_type(self._declared_type)
+        if not self._instance or info.depth >= ModelInfo.get(type(self._instance)).depth:
+            self._model, self._resolved_type = info.model, self._declared_type
+            return
+
+        self._resolved_type = self._instance._meta.model_name.lower()
+
         # Special case to allow creators to be downgraded to contributors
         # This allows OSF users to mark project contributors as bibiliographic or non-bibiliographic
         # and have that be reflected in SHARE
-        if issubclass(model, apps.get_model('share', 'contributor')):
-            return model
-        return type(self.instance)
+        if issubclass(info.model, apps.get_model('share', 'contributor')):
+            self._model = info.model
+        else:
+            self._model = type(self._instance)
 
     @property
     def is_merge(self):
@@ -246,9 +405,15 @@ class ChangeNode:
 
     @property
     def change(self):
+        # Diffed once and kept until the node's instance or type changes, see also ChangeGraph.changes
+        if self._change is None:
+            self._change = self._diff()
+        return self._change
+
+    def _diff(self):
         changes, relations = {}, {}
 
-        extra = copy.deepcopy(self.extra)
+        extra = copy.deepcopy(self.extra) if self.extra else {}
         if self.namespace:
             if self.namespace and getattr(self.instance, 'extra', None):
                 # NOTE extra changes are only diffed at the top level
@@ -309,24 +474,15 @@ class ChangeNode:
     def __init__(self, graph, id, type, attrs, namespace=None):
         self.graph = graph
         self._id = id
+        self._instance = None
         self._type = type.lower()
-        self.instance = None
         self.attrs = attrs
-        self.extra = attrs.pop('extra', {})
-        self.context = attrs.pop('@context', {})
+        self.extra = attrs.pop('extra', None) or EMPTY_MAPPING
+        self.context = attrs.pop('@context', None) or EMPTY_MAPPING
         self.namespace = namespace
 
-        if not self.is_blank:
-            self.instance = IDObfuscator.load(self.id, None)
-            if not self.instance or self.instance._meta.concrete_model is not self.model._meta.concrete_model:
-                raise UnresolvableReference((self.id, self.type))
-
     def related(self, name=None, forward=True, backward=True):
-        edges = tuple(
-            e for e in self.graph.relations[self]
-            if (forward is True and e.subject is self and (name is None or e.name == name))
-            or (backward is True and e.related is self and (name is None or e.remote_name == name))
-        )
+        edges = self.graph.edges(self, name=name, forward=forward is True, backward=backward is True)
 
         if not name:
             return edges
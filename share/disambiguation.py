@@ -1,20 +1,134 @@
 import logging
+import operator
+import collections
+import functools
+import heapq
+
 import pendulum
 
+from django.conf import settings
+from django.db import connection
 from django.db.models import Q, DateTimeField
 from django.core.exceptions import ValidationError
 
-from share.util import DictHashingDict
+from share.util import hashable
+from share.util import ModelInfo
+from share.util import SubjectTaxonomy
+from share.util import chunked
 
-__all__ = ('GraphDisambiguator', )
+__all__ = ('GraphDisambiguator', 'DisambiguationCache', )
 
 logger = logging.getLogger(__name__)
 
 
+class DisambiguationCache:
+    """Worker-local LRU cache of (concrete model, disambiguation key) -> pk
+
+    Only keys that identify at most one row (unique fields or unique_together) are cached,
+    so a cached pk is exactly what the database query would have found.
+    Any change that could invalidate a key clears the cache and bumps a generation counter
+    in the database, which every worker checks before disambiguating a graph.
+    """
+    GENERATION_SEQUENCE = 'share_disambiguation_generation'
+
+    _cache = collections.OrderedDict()
+    _unique = {}
+    _generation = None
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def get(cls, key):
+        if not cls.is_cacheable(key):
+            return None
+        try:
+            pk = cls._cache[key]
+        except KeyError:
+            cls.misses += 1
+            return None
+        cls.hits += 1
+        cls._cache.move_to_end(key)
+        return pk
+
+    @classmethod
+    def set(cls, key, pk):
+        if not cls.is_cacheable(key) or settings.SHARE_DISAMBIGUATION_CACHE_SIZE < 1:
+            return
+        cls._cache[key] = pk
+        cls._cache.move_to_end(key)
+        while len(cls._cache) > settings.SHARE_DISAMBIGUATION_CACHE_SIZE:
+            cls._cache.popitem(last=False)
+
+    @classmethod
+    def discard(cls, key):
+        cls._cache.pop(key, None)
+
+    @classmethod
+    def clear(cls):
+        cls._cache.clear()
+
+    @classmethod
+    def stats(cls):
+        total = cls.hits + cls.misses
+        return {'size': len(cls._cache), 'hits': cls.hits, 'misses': cls.misses, 'hit_rate': cls.hits / total if total else 0.0}
+
+    @classmethod
+    def is_cacheable(cls, key):
+        if key is None:
+            return False
+        model, fields = key[:2]
+        try:
+            return cls._unique[model, fields]
+        except KeyError:
+            pass
+        names = tuple(f[:-4] if f.endswith('__id') else f for f in fields)
+        if len(names) == 1:
+            unique = model._meta.get_field(names[0]).unique
+        else:
+            unique = any(set(names) == set(together) for together in model._meta.unique_together)
+        return cls._unique.setdefault((model, fields), unique)
+
+    @classmethod
+    def is_affected_by(cls, model, fields):
+        # Would changing these fields of model invalidate any cached keys
+        # Changing the type of a typed model changes which keys it may be found by
+        if 'type' in fields:
+            return True
+        try:
+            disambiguation = model.Disambiguation
+        except AttributeError:
+            return False
+        return bool(set(getattr(disambiguation, 'all', ())) & set(fields)) and not getattr(disambiguation, 'any', ())
+
+    @classmethod
+    def invalidate(cls):
+        # Clear this worker's cache and tell every other worker to do the same
+        cls.clear()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s);', (cls.GENERATION_SEQUENCE, ))
+            cls._generation, = cursor.fetchone()
+
+    @classmethod
+    def sync(cls):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT last_value FROM {};'.format(cls.GENERATION_SEQUENCE))
+            generation, = cursor.fetchone()
+        if generation != cls._generation:
+            logger.debug('Disambiguation generation changed from %s to %s, clearing cache', cls._generation, generation)
+            cls.clear()
+            cls._generation = generation
+
+
 class GraphDisambiguator:
 
-    def __init__(self):
+    # Max number of values to put in a single batched query
+    BATCH_SIZE = 500
+
+    def __init__(self, batch=True):
         self._index = self.NodeIndex()
+        self._batch = batch
+        # Results of batched queries, see _prefetch_instances
+        self._prefetched = {}
 
     def prune(self, change_graph):
         # for each node in the graph, compare to each other node and remove duplicates
@@ -28,61 +142,170 @@ class GraphDisambiguator:
         return self._disambiguate(change_graph, True)
 
     def _disambiguate(self, change_graph, find_instances):
-        changed = True
+        self._index.clear()
+        self._prefetched.clear()
+        if find_instances:
+            # Once per pass, every cached key used below is checked against the same generation
+            DisambiguationCache.sync()
+        weights = {n: self._disambiguweight(n) for n in change_graph.nodes}
         # Sort by type and id as well to get consitent sorting
-        nodes = sorted(change_graph.nodes, key=lambda x: (self._disambiguweight(x), x.type, x.id), reverse=True)
-
-        while changed:
-            changed = False
-            # TODO update affected nodes after changes instead of rebuilding the index every loop
-            self._index.clear()
-
-            for n in tuple(nodes):
-                if n.is_merge or (find_instances and n.instance):
+        nodes = sorted(change_graph.nodes, key=lambda x: (weights[x], x.type, x.id), reverse=True)
+
+        # Worklist of nodes to (re)visit, always popped in the order above.
+        # After a merge or a match in the database, only the nodes whose NodeInfo may
+        # have changed are re-queued, instead of starting over with every node.
+        ranks = {n: i for i, n in enumerate(nodes)}
+        queue = list(enumerate(nodes))
+        queued = set(nodes)
+        # weight -> nodes whose instance has not been prefetched since their NodeInfo last changed
+        # Each round of resolutions requeues nodes, which are prefetched again with the rest of their weight
+        unfetched = {}
+        if find_instances:
+            for n in nodes:
+                unfetched.setdefault(weights[n], set()).add(n)
+
+        def requeue(node):
+            if node not in change_graph.nodes:
+                return
+            self._index.discard(node)
+            if find_instances:
+                unfetched.setdefault(weights[node], set()).add(node)
+            if node not in queued:
+                queued.add(node)
+                heapq.heappush(queue, (ranks[node], node))
+
+        while queue:
+            _, n = heapq.heappop(queue)
+            queued.discard(n)
+
+            if n not in change_graph.nodes or n.is_merge or (find_instances and n.instance):
+                continue
+
+            if n in unfetched.get(weights[n], ()):
+                self._prefetch_instances([x for x in unfetched.pop(weights[n]) if x in change_graph.nodes])
+
+            matches = self._index.get_matches(n)
+            if len(matches) > 1:
+                # TODO?
+                raise NotImplementedError('Multiple matches that apparently didn\'t match each other?\nNode: {}\nMatches: {}'.format(n, matches))
+
+            if matches:
+                # remove duplicates within the graph
+                match = matches.pop()
+                # keep the node with the more-specific class, otherwise the one that comes first
+                if issubclass(n.model, match.model) == issubclass(match.model, n.model):
+                    keep_n = ranks[n] < ranks[match]
+                else:
+                    keep_n = issubclass(n.model, match.model)
+                source, replacement = (match, n) if keep_n else (n, match)
+
+                logger.debug('Found duplicate! Keeping {}, pruning {}'.format(replacement, source))
+                self._index.discard(source)
+                self._merge_nodes(source, replacement)
+                for node in (replacement, *self._neighbours(replacement)):
+                    requeue(node)
+                continue
+
+            if find_instances:
+                # look for matches in the database
+                instance = self._instance_for_node(n)
+                # if instance and isinstance(instance, list):
+                #     same_type = [i for i in instance if isinstance(i, n.model)]
+                #     if not same_type:
+                #         logger.error('Found multiple matches for %s, and none were of type %s: %s', n, n.model, instance)
+                #         raise NotImplementedError('Multiple matches found', n, instance)
+                #     elif len(same_type) > 1:
+                #         logger.error('Found multiple matches of type %s for %s: %s', n.model, n, same_type)
+                #         raise NotImplementedError('Multiple matches found', n, same_type)
+                #     logger.warning('Found multiple matches for %s, but only one of type %s, fortunately.', n, n.model)
+                #     instance = same_type.pop()
+                if instance:
+                    n.instance = instance
+                    logger.debug('Disambiguated %s to %s', n, instance)
+                    # Nodes that refer to n may be found in the database now
+                    for node in self._neighbours(n):
+                        requeue(node)
+                elif n.type == 'subject':
+                    raise ValidationError('Invalid subject: "{}"'.format(n.attrs.get('name')))
+
+            self._index.add(n)
+
+    def _neighbours(self, node):
+        # NodeInfo only looks one edge away, so these are the only nodes that can be affected by a change to node
+        return {e.related if e.subject is node else e.subject for e in node.related()}
+
+    def _prefetch_instances(self, nodes):
+        # Nodes that are disambiguated solely by `all` fields are grouped by model and shape
+        # and resolved with one query per group. Results are keyed by the exact query a node would
+        # run, so _instance_for_node only uses them if the node hasn't changed since.
+        # Keys found in the DisambiguationCache are always resolved here, with one in_bulk per model,
+        # the grouped queries are skipped unless batching is enabled.
+        groups = {}
+        cached = {}
+        for node in nodes:
+            if node.is_merge or node.instance or node.type == 'subject':
+                continue
+            # Shares the index's NodeInfo, which is discarded whenever the node is requeued
+            key = self._batch_key(node, self._index.get_info(node))
+            if key is None or key in self._prefetched:
+                continue
+            pk = DisambiguationCache.get(key)
+            if pk is not None:
+                cached.setdefault(key[0], []).append((pk, key))
+            elif self._batch:
+                model, fields, values, types = key
+                groups.setdefault((model, fields, types), set()).add(values)
+
+        for model, keys in cached.items():
+            instances = model.objects.in_bulk([pk for pk, _ in keys])
+            for pk, key in keys:
+                if pk in instances:
+                    self._prefetched[key] = instances[pk]
                     continue
-                matches = self._index.get_matches(n)
-                if len(matches) > 1:
-                    # TODO?
-                    raise NotImplementedError('Multiple matches that apparently didn\'t match each other?\nNode: {}\nMatches: {}'.format(n, matches))
-
-                if matches:
-                    # remove duplicates within the graph
-                    match = matches.pop()
-                    if n.model != match.model and issubclass(n.model, match.model):
-                        # remove the node with the less-specific class
-                        logger.debug('Found duplicate! Keeping {}, pruning {}'.format(n, match))
-                        self._index.remove(match)
-                        nodes.remove(match)
-                        self._merge_nodes(match, n)
-                        self._index.add(n)
-                    else:
-                        logger.debug('Found duplicate! Keeping {}, pruning {}'.format(match, n))
-                        nodes.remove(n)
-                        self._merge_nodes(n, match)
-                    changed = True
+                # The row is gone, look it up again
+                DisambiguationCache.discard(key)
+                if self._batch:
+                    model, fields, values, types = key
+                    groups.setdefault((model, fields, types), set()).add(values)
+
+        for (model, fields, types), values in groups.items():
+            found = {}
+            queryset = model.objects.all()
+            if types:
+                queryset = queryset.filter(type__in=types)
+
+            for chunk in chunked(values, size=self.BATCH_SIZE):
+                if not chunk:
                     continue
+                if len(fields) == 1:
+                    query = Q(**{fields[0] + '__in': [v for v, in chunk]})
+                else:
+                    query = functools.reduce(operator.or_, (Q(**dict(zip(fields, v))) for v in chunk))
+                for instance in queryset.filter(query):
+                    found.setdefault(tuple(self._batch_value(instance, f) for f in fields), []).append(instance)
+
+            logger.debug('Batch disambiguated %d %ss, found %d', len(values), model, len(found))
+            for value in values:
+                matches = found.get(value, ())
+                # Multiple matches are left to _instance_for_node, which raises the appropriate error
+                if len(matches) < 2:
+                    self._prefetched[model, fields, value, types] = matches[0] if matches else None
+                if len(matches) == 1:
+                    DisambiguationCache.set((model, fields, value, types), matches[0].pk)
+
+    def _batch_key(self, node, info):
+        if info.any or not info.all:
+            return None
+        pairs = tuple(self._query_pair(k, v) for k, v in info.all)
+        if not all(k and v for k, v in pairs):
+            return None
+        fields, values = zip(*pairs)
+        return (node.model._meta.concrete_model, fields, values, frozenset(info.matching_types) if info.matching_types else None)
 
-                if find_instances:
-                    # look for matches in the database
-                    instance = self._instance_for_node(n)
-                    # if instance and isinstance(instance, list):
-                    #     same_type = [i for i in instance if isinstance(i, n.model)]
-                    #     if not same_type:
-                    #         logger.error('Found multiple matches for %s, and none were of type %s: %s', n, n.model, instance)
-                    #         raise NotImplementedError('Multiple matches found', n, instance)
-                    #     elif len(same_type) > 1:
-                    #         logger.error('Found multiple matches of type %s for %s: %s', n.model, n, same_type)
-                    #         raise NotImplementedError('Multiple matches found', n, same_type)
-                    #     logger.warning('Found multiple matches for %s, but only one of type %s, fortunately.', n, n.model)
-                    #     instance = same_type.pop()
-                    if instance:
-                        changed = True
-                        n.instance = instance
-                        logger.debug('Disambiguated %s to %s', n, instance)
-                    elif n.type == 'subject':
-                        raise ValidationError('Invalid subject: "{}"'.format(n.attrs.get('name')))
-
-                self._index.add(n)
+    def _batch_value(self, instance, field):
+        if field.endswith('__id'):
+            return getattr(instance, instance._meta.get_field(field[:-4]).attname)
+        return getattr(instance, field)
 
     def _disambiguweight(self, node):
         # Models with exactly 1 foreign key field (excluding those added by
@@ -94,12 +317,22 @@ class GraphDisambiguator:
         return fk_count if fk_count == 1 else -fk_count
 
     def _instance_for_node(self, node):
+        if node.type == 'subject':
+            # Subjects are a fixed set, never hit the database for them
+            name = node.attrs.get('name')
+            return SubjectTaxonomy.get(name) if name else None
+
         info = self._index.get_info(node)
         concrete_model = node.model._meta.concrete_model
 
         if not info.all and not info.any:
             return None
 
+        # Cached keys were resolved by _prefetch_instances
+        key = self._batch_key(node, info)
+        if key in self._prefetched:
+            return self._prefetched[key]
+
         all_query = Q()
         for k, v in info.all:
             k, v = self._query_pair(k, v)
@@ -122,7 +355,7 @@ class GraphDisambiguator:
 
         constrain = [Q()]
         if hasattr(node.model, '_typedmodels_type'):
-            constrain.append(Q(type__in=node.model.get_types()))
+            constrain.append(Q(type__in=ModelInfo.get(node.model).types))
             constrain.append(Q(type=node.model._typedmodels_type))
 
         for q in constrain:
@@ -133,6 +366,8 @@ class GraphDisambiguator:
                 logger.debug('No %ss found for %s %s', concrete_model, all_query & q, queries)
                 return None
             if len(found) == 1:
+                if key:
+                    DisambiguationCache.set(key, found[0].pk)
                 return found[0]
             if all_query.children:
                 logger.warning('Multiple %ss returned for %s (The main query) bailing', concrete_model, all_query)
@@ -179,12 +414,20 @@ class GraphDisambiguator:
     class NodeIndex:
         def __init__(self):
             self._index = {}
+            self._indexed = set()
             self._info_cache = {}
 
         def clear(self):
             self._index.clear()
+            self._indexed.clear()
             self._info_cache.clear()
 
+        def discard(self, node):
+            # Forget everything known about node, its info is recomputed the next time it is needed
+            if node in self._indexed:
+                self.remove(node)
+            self._info_cache.pop(node, None)
+
         def get_info(self, node):
             try:
                 return self._info_cache[node]
@@ -195,25 +438,28 @@ class GraphDisambiguator:
 
         def add(self, node):
             info = self.get_info(node)
-            by_model = self._index.setdefault(node.model._meta.concrete_model, DictHashingDict())
+            by_model = self._index.setdefault(node.model._meta.concrete_model, {})
             if info.any:
-                all_cache = by_model.setdefault(info.all, DictHashingDict())
-                for item in info.any:
+                all_cache = by_model.setdefault(info.all_key, {})
+                for item in info.any_keys:
                     all_cache.setdefault(item, []).append(node)
+                self._indexed.add(node)
             elif info.all:
-                by_model.setdefault(info.all, []).append(node)
+                by_model.setdefault(info.all_key, []).append(node)
+                self._indexed.add(node)
             else:
                 logger.debug('Nothing to disambiguate on. Ignoring node {}'.format(node))
 
         def remove(self, node):
             info = self.get_info(node)
             try:
-                all_cache = self._index[node.model._meta.concrete_model][info.all]
+                all_cache = self._index[node.model._meta.concrete_model][info.all_key]
                 if info.any:
-                    for item in info.any:
+                    for item in info.any_keys:
                         all_cache[item].remove(node)
                 else:
                     all_cache.remove(node)
+                self._indexed.discard(node)
             except (KeyError, ValueError) as ex:
                 raise ValueError('Could not remove node from cache: Node {} not found!'.format(node)) from ex
 
@@ -221,9 +467,9 @@ class GraphDisambiguator:
             info = self.get_info(node)
             matches = set()
             try:
-                matches_all = self._index[node.model._meta.concrete_model][info.all]
+                matches_all = self._index[node.model._meta.concrete_model][info.all_key]
                 if info.any:
-                    for item in info.any:
+                    for item in info.any_keys:
                         matches.update(matches_all.get(item, []))
                 elif info.all:
                     matches.update(matches_all)
@@ -242,6 +488,9 @@ class GraphDisambiguator:
                 self.all = self._all()
                 self.any = self._any()
                 self.matching_types = self._matching_types()
+                # Keys into NodeIndex, computed once so lookups are plain dict lookups
+                self.all_key = hashable(self.all)
+                self.any_keys = tuple(hashable(item) for item in self.any)
 
             def _all(self):
                 try:
@@ -272,9 +521,8 @@ class GraphDisambiguator:
                 if concrete_model is self._node.model:
                     type_names = [self._node.model._meta.label_lower]
                 else:
-                    subclasses = self._node.model.get_types()
-                    superclasses = [m._meta.label_lower for m in self._node.model.__mro__ if issubclass(m, concrete_model) and m._meta.proxy]
-                    type_names = subclasses + superclasses
+                    info = ModelInfo.get(self._node.model)
+                    type_names = list(info.types) + [m._meta.label_lower for m in info.proxy_parents]
                 return set(type_names)
 
             def _field_values(self, field_name):
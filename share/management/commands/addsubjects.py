@@ -6,6 +6,7 @@ from django.db import connection
 from django.db import transaction
 
 from share.models import Subject
+from share.util import SubjectTaxonomy
 
 
 class Command(BaseCommand):
@@ -18,6 +19,7 @@ class Command(BaseCommand):
 
         self.stdout.write('Saving {} unique subjects...'.format(len(subjects)))
         self.save_subjects(subjects)
+        SubjectTaxonomy.clear_cache()
 
     @transaction.atomic
     def save_subjects(self, subjects):
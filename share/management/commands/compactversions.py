@@ -0,0 +1,114 @@
+import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import transaction
+from django.utils import timezone
+
+from share.util import TopographicalSorter
+
+
+class Command(BaseCommand):
+    help = 'Remove old versions of SHARE objects, keeping the latest versions of each object and any version something still points to'
+
+    FK_QUERY = '''
+        SELECT kcu.table_name, kcu.column_name
+        FROM information_schema.table_constraints AS tc
+        JOIN information_schema.constraint_column_usage AS ccu
+            USING (constraint_schema, constraint_name)
+        JOIN information_schema.key_column_usage AS kcu
+            USING (constraint_schema, constraint_name)
+        WHERE tc.constraint_type = 'FOREIGN KEY'
+            AND ccu.table_name = %s
+            AND ccu.column_name = %s;
+    '''
+
+    # The version foreign keys are not indexed, so every version something points at is gathered up front
+    # with a single scan of each referencing table, rather than looked up once per batch.
+    REFERENCED_TABLE = 'compactversions_referenced'
+
+    # Ranks each object's versions, newest first. Only versions past the retention policy
+    # that no foreign key points at are candidates, deleting anything else would cascade.
+    # New rows only point at current versions, so objects modified since the references were gathered are left alone.
+    CANDIDATES_QUERY = '''
+        SELECT ranked.id FROM (
+            SELECT id, persistent_id, date_modified, row_number() OVER (PARTITION BY persistent_id ORDER BY date_modified DESC, id DESC) AS rank
+            FROM "{table}"
+            WHERE persistent_id >= %(start)s AND persistent_id < %(end)s
+        ) AS ranked
+        WHERE ranked.rank > %(keep)s AND ranked.date_modified < %(cutoff)s
+        AND NOT EXISTS (SELECT 1 FROM "{referenced}" WHERE "{referenced}".id = ranked.id)
+        AND NOT EXISTS (SELECT 1 FROM "{table}" AS newer WHERE newer.persistent_id = ranked.persistent_id AND newer.date_modified >= %(started)s)
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', type=str, help='Names of the models to compact, defaults to all of them')
+        parser.add_argument('--days', type=int, default=settings.SHARE_VERSION_RETENTION_DAYS, help='Only remove versions older than this many days')
+        parser.add_argument('--keep', type=int, default=settings.SHARE_VERSION_RETENTION_KEEP, help='The number of latest versions to keep for every object')
+        parser.add_argument('--batch-size', type=int, default=10000, help='The number of objects to compact per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Count the versions that would be removed without removing them')
+
+    def handle(self, *args, **options):
+        if options['keep'] < 1:
+            raise ValueError('At least one version of every object must be kept, --keep was {}'.format(options['keep']))
+
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        models = [
+            model.VersionModel for model in apps.get_models()
+            if hasattr(model, 'VersionModel') and model._meta.concrete_model is model
+            and (not options['models'] or model._meta.model_name in options['models'])
+        ]
+
+        with connection.cursor() as cursor:
+            references = {}
+            for model in models:
+                cursor.execute(self.FK_QUERY, [model._meta.db_table, model._meta.pk.column])
+                references[model._meta.db_table] = [(table, column) for table, column in cursor.fetchall()]
+
+        # Compact versions before the versions they point to, so the latter are no longer referenced when their turn comes
+        tables = TopographicalSorter(
+            references.keys(),
+            dependencies=lambda table: [t for t, _ in references[table] if t != table and t in references],
+        ).sorted()
+
+        total = 0
+        for table in tables:
+            removed = self.compact(table, references[table], cutoff, options)
+            self.stdout.write('{} {} versions from {}'.format('Would remove' if options['dry_run'] else 'Removed', removed, table))
+            total += removed
+
+        self.stdout.write('{} {} versions in total'.format('Would remove' if options['dry_run'] else 'Removed', total))
+
+    def compact(self, table, references, cutoff, options):
+        candidates = self.CANDIDATES_QUERY.format(table=table, referenced=self.REFERENCED_TABLE)
+        if options['dry_run']:
+            query = 'SELECT count(*) FROM ({}) AS candidates;'.format(candidates)
+        else:
+            query = 'WITH deleted AS (DELETE FROM "{}" WHERE id IN ({}) RETURNING 1) SELECT count(*) FROM deleted;'.format(table, candidates)
+
+        removed = 0
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT min(persistent_id), max(persistent_id) FROM "{}";'.format(table))
+            start, last = cursor.fetchone()
+            if start is None:
+                return removed
+
+            started = timezone.now()
+            cursor.execute('CREATE TEMPORARY TABLE "{}" (id integer PRIMARY KEY);'.format(self.REFERENCED_TABLE))
+            try:
+                for reference in references:
+                    cursor.execute('INSERT INTO "{0}" (id) SELECT DISTINCT "{2}" FROM "{1}" WHERE "{2}" IS NOT NULL ON CONFLICT DO NOTHING;'.format(self.REFERENCED_TABLE, *reference))
+                cursor.execute('ANALYZE "{}";'.format(self.REFERENCED_TABLE))
+
+                while start <= last:
+                    end = start + options['batch_size']
+                    with transaction.atomic():
+                        cursor.execute(query, {'start': start, 'end': end, 'keep': options['keep'], 'cutoff': cutoff, 'started': started})
+                        removed += cursor.fetchone()[0]
+                    start = end
+            finally:
+                cursor.execute('DROP TABLE IF EXISTS "{}";'.format(self.REFERENCED_TABLE))
+
+        return removed
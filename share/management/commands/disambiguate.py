@@ -4,6 +4,8 @@ from django.conf import settings
 
 from share.models import ShareUser, NormalizedData
 from share.tasks import DisambiguatorTask
+from share.tasks import BatchDisambiguatorTask
+from share.util import chunked
 
 
 class Command(BaseCommand):
@@ -13,6 +15,7 @@ class Command(BaseCommand):
         parser.add_argument('normalized', nargs='*', type=int, help='The id(*) of the normalized data to make changes for')
         parser.add_argument('--all', action='store_true', help='Make changes for all normalized data for the source specified')
         parser.add_argument('--async', action='store_true', help='Whether or not to use Celery')
+        parser.add_argument('--batch-size', type=int, default=None, help='Make changes for this many normalized data per task')
 
     def handle(self, *args, **options):
         user = ShareUser.objects.get(username=settings.APPLICATION_USERNAME)
@@ -21,6 +24,18 @@ class Command(BaseCommand):
         if not options['normalized'] and options['all']:
             options['normalized'] = NormalizedData.objects.filter(raw__app_label=config.label).values_list('id', flat=True)
 
+        if options['batch_size']:
+            for ids in chunked(options['normalized'], size=options['batch_size']):
+                if not ids:
+                    continue
+                task_args = (user.id, ids)
+
+                if options['async']:
+                    BatchDisambiguatorTask().apply_async(task_args)
+                else:
+                    BatchDisambiguatorTask().apply(task_args, throw=True)
+            return
+
         for id in options['normalized']:
             task_args = (user.id, id)
 
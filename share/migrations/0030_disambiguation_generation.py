@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share', '0029_source_is_deleted'),
+    ]
+
+    # Bumped whenever a change may invalidate workers' disambiguation caches. See share.disambiguation.DisambiguationCache
+    operations = [
+        migrations.RunSQL(
+            'CREATE SEQUENCE share_disambiguation_generation;',
+            reverse_sql='DROP SEQUENCE IF EXISTS share_disambiguation_generation;'
+        )
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share', '0030_disambiguation_generation'),
+    ]
+
+    # Existing rows are left unhashed, they will never match a new submission
+    operations = [
+        migrations.AddField(
+            model_name='normalizeddata',
+            name='sha256',
+            field=models.TextField(null=True, validators=[django.core.validators.MaxLengthValidator(64)]),
+        ),
+    ]
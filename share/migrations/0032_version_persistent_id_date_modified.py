@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share', '0031_normalizeddata_sha256'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='abstractagentrelationversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='abstractagentversion',
+            index_together=set([('persistent_id', 'date_modified'), ('type', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='abstractagentworkrelationversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='abstractcreativeworkversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='abstractworkrelationversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='agentidentifierversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='awardversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='extradataversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='tagversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='throughawardsversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='throughcontributorversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='throughsubjectsversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='throughtagsversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='workidentifierversion',
+            index_together=set([('persistent_id', 'date_modified')]),
+        ),
+    ]
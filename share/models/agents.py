@@ -4,13 +4,12 @@ import nameparser
 import collections
 
 from django.db import models
-from django.apps import apps
 
 from share.models.base import ShareObject
 from share.models.base import TypedShareObjectMeta
 from share.models.fields import ShareManyToManyField
 from share.transform.chain.links import GuessAgentTypeLink
-from share.util import strip_whitespace, ModelGenerator
+from share.util import strip_whitespace, ModelGenerator, ModelInfo
 
 
 logger = logging.getLogger('share.normalize')
@@ -48,7 +47,7 @@ class AbstractAgent(ShareObject, metaclass=TypedShareObjectMeta):
 
         maybe_type = GuessAgentTypeLink(default=node.type).execute(node.attrs['name'])
         # If the new type is MORE specific, IE encompasses FEWER types, upgrade. Otherwise ignore
-        if len(apps.get_model('share', maybe_type).get_types()) < len(node.model.get_types()):
+        if len(ModelInfo.for_type(maybe_type).types) < len(ModelInfo.get(node.model).types):
             node._type = maybe_type
 
         match = re.match(r'^(.*(?:Departa?ment|Institute).+?);(?: (.+?); )?([^;]+)$', name, re.I)
@@ -9,6 +9,7 @@ from django.db import models
 from django.db import transaction
 from django.db.models.base import ModelBase
 from django.db.models.fields import AutoField
+from django.db.models.options import normalize_together
 from django.utils.translation import ugettext_lazy as _
 
 from typedmodels import models as typedmodels
@@ -29,6 +30,8 @@ class ShareObjectVersion(models.Model):
     class Meta:
         abstract = True
         ordering = ('-date_modified', )
+        # Supports VersionManager, which lists an object's versions by date
+        index_together = (('persistent_id', 'date_modified'), )
 
 
 # Generates 2 class from the original definition of the model
@@ -63,7 +66,11 @@ class ShareObjectMeta(ModelBase):
                 if isinstance(val, (fields.ShareForeignKey, fields.ShareManyToManyField, fields.ShareOneToOneField)):
                     val._kwargs = {**val._kwargs, 'related_name': '+', 'db_index': False}
             if key == 'Meta':
-                val = type('VersionMeta', (val, ), {'unique_together': None, 'db_table': val.db_table + 'version' if hasattr(val, 'db_table') else None})
+                val = type('VersionMeta', (val, ), {
+                    'unique_together': None,
+                    'index_together': normalize_together(getattr(val, 'index_together', ())) + ShareObjectVersion.Meta.index_together,
+                    'db_table': val.db_table + 'version' if hasattr(val, 'db_table') else None,
+                })
             version_attrs[key] = val
 
         # TODO Fix this in some non-horrid fashion
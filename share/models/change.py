@@ -12,9 +12,16 @@ from django.db import transaction
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 
+from share.disambiguation import DisambiguationCache
 from share.models.fuzzycount import FuzzyCountManager
 from share.models import NormalizedData
+from share.models.sql import bulk_insert
+from share.models.sql import claim_unique
+from share.models.sql import lock_unique
+from share.models.sql import unique_lock_ids
+from share.models.sql import bulk_update
 from share.util import IDObfuscator
+from share.util import chunked
 
 
 __all__ = ('Change', 'ChangeSet', )
@@ -24,22 +31,30 @@ logger = logging.getLogger(__name__)
 class ChangeSetManager(FuzzyCountManager):
 
     def from_graph(self, graph, normalized_data_id):
-        if all(n.is_skippable for n in graph.nodes):
+        changes = graph.changes()
+        if not changes:
             logger.debug('No changes detected in {!r}, skipping.'.format(graph))
             return None
 
         cs = ChangeSet(normalized_data_id=normalized_data_id)
         cs.save()
 
-        Change.objects.bulk_create(filter(None, [Change.objects.from_node(node, cs, save=False) for node in graph.nodes]))
+        Change.objects.bulk_create(filter(None, [
+            Change.objects.from_node(node, cs, save=False, change=changes[node])
+            for node in graph.nodes
+            if node in changes
+        ]))
 
         return cs
 
 
 class ChangeManager(FuzzyCountManager):
 
-    def from_node(self, node, change_set, save=True):
-        if node.is_skippable:
+    def from_node(self, node, change_set, save=True, change=None):
+        # change may be given if it has already been computed, see ChangeGraph.changes
+        if change is None:
+            change = node.change
+        if node.is_merge or (node.instance and not change):
             logger.debug('No changes detected in {!r}, skipping.'.format(node))
             return None
         if not hasattr(node.model, 'VersionModel'):
@@ -50,7 +65,7 @@ class ChangeManager(FuzzyCountManager):
 
         attrs = {
             'node_id': node.id,
-            'change': node.change,
+            'change': change,
             'change_set': change_set,
             'model_type': ContentType.objects.get_for_model(node.model, for_concrete_model=False),
             'target_type': ContentType.objects.get_for_model(node.model, for_concrete_model=True),
@@ -64,7 +79,7 @@ class ChangeManager(FuzzyCountManager):
         else:
             attrs['type'] = Change.TYPE.update
             attrs['target_id'] = node.instance.pk
-            attrs['target_version_id'] = node.instance.version.pk
+            attrs['target_version_id'] = node.instance.version_id
 
         change = Change(**attrs)
 
@@ -84,32 +99,280 @@ class ChangeSet(models.Model):
     normalized_data = models.ForeignKey(NormalizedData)
 
     _changes_cache = []
+    # (target content type id, node_id) -> target of every accepted change
+    _targets = {}
+    # Encoded id -> instance of every concrete reference, see _resolve_ref
+    _ref_cache = {}
 
     def accept(self, save=True):
         ret = []
         with transaction.atomic():
             self._changes_cache = list(self.changes.all())
-            for c in self._changes_cache:
-                ret.append(c.accept(save=save))
+            self._targets = {}
+            self._ref_cache = IDObfuscator.load_many({
+                id for c in self._changes_cache for _, id in self._refs(c.change) if not id.startswith('_:')
+            })
+            if save:
+                ret = self._accept_all()
+            else:
+                for c in self._changes_cache:
+                    ret.append(c.accept(save=save))
+                    if c.type != Change.TYPE.merge:
+                        self._targets[c.target_type_id, c.node_id] = ret[-1]
             self.status = ChangeSet.STATUS.accepted
             if save:
                 self.save()
         return ret
 
+    def _accept_all(self):
+        # Set based equivalent of calling Change.accept on every change.
+        # Creates are inserted and updates written with one statement per model per level,
+        # see _levels. Merges are still applied one at a time.
+        assert self.status == ChangeSet.STATUS.pending, 'Cannot accept a change with status {}'.format(self.status)
+        logger.debug('Accepting %d changes of %r', len(self._changes_cache), self)
+
+        self._load_targets([c for c in self._changes_cache if c.type == Change.TYPE.update])
+        self._lock_unique_keys()
+        stale = False
+        ret = {}
+
+        for level in self._levels(self._changes_cache):
+            resolved = {}
+            for change in level:
+                if change.type == Change.TYPE.merge:
+                    continue
+                if change.type == Change.TYPE.update:
+                    stale = stale or DisambiguationCache.is_affected_by(ContentType.objects.get_for_id(change.model_type_id).model_class(), change.change)
+                    change.target.change = change
+                    new_type = change.change.pop('@type', None)
+                    if new_type:
+                        change.target.recast('share.{}'.format(new_type))
+                resolved[change] = change._resolve_change(save_extra=False)
+
+            creates, updates = {}, {}
+            for change, r in resolved.items():
+                if change.type == Change.TYPE.create:
+                    inst = ContentType.objects.get_for_id(change.model_type_id).model_class()(change=change, **r)
+                    creates.setdefault(inst._meta.concrete_model, []).append(change)
+                    ret[change] = inst
+
+            # Concurrent transactions may have created rows with the same unique keys since disambiguation ran.
+            # Use those rows rather than failing on the unique constraint, the keys were locked by _lock_unique_keys.
+            claimed = set()
+            for model, changes in tuple(creates.items()):
+                existing = claim_unique([ret[c] for c in changes], lock=False)
+                for change, row in zip(changes, existing):
+                    if row is not None:
+                        ret[change] = change.target = row
+                        claimed.add(change)
+                creates[model] = [c for c, row in zip(changes, existing) if row is None]
+
+            # ExtraData has to be saved before anything can point to it
+            for change, pins in self._save_extras(list(resolved)).items():
+                resolved[change].update(pins)
+
+            for change, r in resolved.items():
+                if change in claimed:
+                    # Only this source's extra data is merged into a claimed row
+                    if 'extra_version_id' in r:
+                        row = ret[change]
+                        row.change = change
+                        row.__dict__.update({k: v for k, v in r.items() if k in ('extra_id', 'extra_version_id')})
+                        fields = frozenset({'change', 'date_modified'} | {f.name for f in row._meta.concrete_fields if f.attname in r and f.attname.startswith('extra')})
+                        updates.setdefault((row._meta.concrete_model, fields), []).append(row)
+                elif change.type == Change.TYPE.create:
+                    ret[change].__dict__.update(r)
+                else:
+                    target = change.target
+                    target.__dict__.update(r)
+                    fields = {'change', 'date_modified'}
+                    fields.update(f.name for f in target._meta.concrete_fields if f.attname in r)
+                    if hasattr(target, '_typedmodels_type'):
+                        fields.add('type')
+                    updates.setdefault((target._meta.concrete_model, frozenset(fields)), []).append(target)
+                    ret[change] = target
+
+            for changes in creates.values():
+                bulk_insert([ret[c] for c in changes])
+            for (model, fields), targets in updates.items():
+                bulk_update(targets, sorted(fields))
+            for change in resolved:
+                if change.type == Change.TYPE.create:
+                    change.target = ret[change]
+                self._targets[change.target_type_id, change.node_id] = ret[change]
+
+            for change in level:
+                if change.type == Change.TYPE.merge:
+                    stale = True
+                    ret[change] = change._merge()
+                    # Merged rows have been modified, stop using the prefetched copies
+                    self._ref_cache = {}
+
+        ret = [ret[c] for c in self._changes_cache]
+        self._add_sources(ret)
+        bulk_update(self._changes_cache, ['target_id', 'change'])
+
+        if stale:
+            DisambiguationCache.invalidate()
+
+        return ret
+
+    def _lock_unique_keys(self):
+        # Lock the unique key of every create up front, in one statement, see lock_unique.
+        # Keys that refer to rows this change set creates are not known until those rows exist and are not locked.
+        # Nothing else can refer to a new row. A row claimed by claim_unique is the one exception, a concurrent
+        # transaction creating the same key still fails on the unique constraint there and is retried.
+        updated = {(c.target_type_id, c.node_id): c.target_id for c in self._changes_cache if c.type == Change.TYPE.update}
+        locks = set()
+        for change in self._changes_cache:
+            if change.type != Change.TYPE.create:
+                continue
+            model = ContentType.objects.get_for_id(change.model_type_id).model_class()
+            values = {}
+            for k, v in change.change.items():
+                if k == 'extra' or isinstance(v, list):
+                    continue
+                if not isinstance(v, dict):
+                    values[k] = v
+                    continue
+                ct_id = ContentType.objects.get_for_model(apps.get_model('share', model_name=v['@type']), for_concrete_model=True).id
+                if (ct_id, v['@id']) in updated:
+                    values[model._meta.get_field(k).attname] = updated[ct_id, v['@id']]
+                elif not v['@id'].startswith('_:'):
+                    values[model._meta.get_field(k).attname] = IDObfuscator.decode_id(v['@id'])
+            locks.update(unique_lock_ids(model, values))
+        lock_unique(locks)
+
+    def _levels(self, changes):
+        # Split changes into levels, each of which only refers to changes in earlier levels.
+        # Updates are referred to by their concrete id, which is also their node_id.
+        # Merges touch rows all over the database, so each gets a level of its own.
+        levels, placed = [], {}
+        floor = 0
+        for change in changes:
+            if change.type == Change.TYPE.merge:
+                level = len(levels)
+                floor = level + 1
+            else:
+                level = max([floor] + [placed[ref] + 1 for ref in self._refs(change.change) if ref in placed])
+            placed[change.target_type_id, change.node_id] = level
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(change)
+        return levels
+
+    def _refs(self, change):
+        # (target content type id, @id) of every reference in a change, found the same way as Change._resolve_change
+        for k, v in change.items():
+            if k == 'extra':
+                continue
+            for ref in (v if isinstance(v, list) else [v]):
+                if isinstance(ref, dict):
+                    model = apps.get_model('share', model_name=ref['@type'])
+                    yield ContentType.objects.get_for_model(model, for_concrete_model=True).id, ref['@id']
+
+    def _save_extras(self, changes):
+        # Each source has its own namespace in ExtraData.data. Existing namespaces are replaced in place with jsonb_set,
+        # the rest of the document never goes through python. Returns the extra_id and extra_version_id to pin on each target.
+        new, existing = [], []
+        for change in changes:
+            if not change.change.get('extra'):
+                continue
+            # Updates and claimed creates have a target, which may already have ExtraData
+            if change.target_id and change.target.extra_id:
+                existing.append(change)
+            else:
+                new.append(change)
+
+        extras = [change._new_extra() for change in new]
+        bulk_insert(extras)
+        pins = {change: {'extra_id': extra.id, 'extra_version_id': extra.version_id} for change, extra in zip(new, extras)}
+
+        if not existing:
+            return pins
+
+        from share.models.base import ExtraData
+        meta = ExtraData._meta
+        data = meta.get_field('data')
+        date_modified = timezone.now()
+        with connection.cursor() as cursor:
+            for chunk in chunked(existing, 500):
+                if not chunk:
+                    continue
+                cursor.execute('''
+                    UPDATE "{table}" SET
+                        "{data}" = jsonb_set("{table}"."{data}", %s, "v"."value"),
+                        "{change}" = "v"."change",
+                        "{date_modified}" = %s
+                    FROM (VALUES {values}) AS "v" ("id", "value", "change")
+                    WHERE "{table}"."{pk}" = "v"."id"
+                    RETURNING "{table}"."{pk}", "{table}"."{version}";
+                '''.format(
+                    table=meta.db_table,
+                    data=data.column,
+                    change=meta.get_field('change').column,
+                    date_modified=meta.get_field('date_modified').column,
+                    pk=meta.pk.column,
+                    version=meta.get_field('version').column,
+                    values=', '.join(['(%s::integer, %s::jsonb, %s::integer)'] * len(chunk)),
+                ), [[self.normalized_data.source.username], date_modified] + [
+                    p for change in chunk for p in (change.target.extra_id, data.get_prep_value(change.change['extra']), change.id)
+                ])
+                versions = dict(cursor.fetchall())
+                for change in chunk:
+                    pins[change] = {'extra_version_id': versions[change.target.extra_id]}
+
+        return pins
+
+    def _load_targets(self, changes):
+        by_type = {}
+        for change in changes:
+            by_type.setdefault(change.target_type_id, []).append(change)
+        for target_type_id, group in by_type.items():
+            model = ContentType.objects.get_for_id(target_type_id).model_class()
+            targets = model.objects.in_bulk([c.target_id for c in group])
+            for change in group:
+                change.target = targets[change.target_id]
+
+    def _add_sources(self, instances):
+        # Psuedo hack, sources.add(...) tries to do some safety checks.
+        # Don't do that. We have a database. That is its job. Let it do its job.
+        by_model = {}
+        for inst in instances:
+            by_model.setdefault(inst._meta.concrete_model, set()).add(inst.pk)
+
+        with connection.cursor() as cursor:
+            for model, pks in by_model.items():
+                through_meta = model._meta.get_field('sources').rel.through._meta
+                cursor.execute('''
+                    INSERT INTO "{0}"
+                        ("{1}", "{2}")
+                    VALUES
+                        {3}
+                    ON CONFLICT DO NOTHING;
+                '''.format(
+                    through_meta.db_table,
+                    through_meta.get_field(model._meta.model_name).column,
+                    through_meta.get_field('shareuser').column,
+                    ', '.join(['(%s, %s)'] * len(pks)),
+                ), [p for pk in sorted(pks) for p in (pk, self.normalized_data.source_id)])
+
     def _resolve_ref(self, ref):
         model = apps.get_model('share', model_name=ref['@type'])
         ct = ContentType.objects.get_for_model(model, for_concrete_model=True)
+        # Blank nodes and objects updated by this change set are found by their node_id
         try:
+            return self._targets[ct.id, ref['@id']]
+        except KeyError as ex:
             if ref['@id'].startswith('_:'):
-                return next(
-                    change.target
-                    for change in self._changes_cache
-                    if change.target_type == ct
-                    and change.node_id == ref['@id']
-                    and change.target
-                )
+                raise Exception('Could not resolve reference {}'.format(ref)) from ex
+
+        inst = self._ref_cache.get(ref['@id'])
+        if isinstance(inst, model._meta.concrete_model):
+            return inst
+        try:
             return model._meta.concrete_model.objects.get(pk=IDObfuscator.decode_id(ref['@id']))
-        except (StopIteration, model.DoesNotExist) as ex:
+        except model.DoesNotExist as ex:
             raise Exception('Could not resolve reference {}'.format(ref)) from ex
 
     def __repr__(self):
@@ -145,8 +408,16 @@ class Change(models.Model):
         # Little bit of blind faith here that all requirements have been accepted
         assert self.change_set.status == ChangeSet.STATUS.pending, 'Cannot accept a change with status {}'.format(self.change_set.status)
         logger.debug('Accepting change node ({}, {})'.format(ContentType.objects.get_for_id(self.model_type_id), self.node_id))
+        # Merges repoint foreign keys, so they may invalidate keys of any model
+        stale = self.type == Change.TYPE.merge or (
+            self.type == Change.TYPE.update
+            and DisambiguationCache.is_affected_by(ContentType.objects.get_for_id(self.model_type_id).model_class(), self.change)
+        )
         ret = self._accept(save)
 
+        if save and stale:
+            DisambiguationCache.invalidate()
+
         if save:
             # Psuedo hack, sources.add(...) tries to do some safety checks.
             # Don't do that. We have a database. That is its job. Let it do its job.
@@ -179,10 +450,26 @@ class Change(models.Model):
         return self._merge(save=save)
 
     def _create(self, save=True):
-        resolved_change = self._resolve_change()
+        resolved_change = self._resolve_change(save_extra=False)
         inst = ContentType.objects.get_for_id(self.model_type_id).model_class()(change=self, **resolved_change)
-        if save:
-            inst.save()
+        # A concurrent transaction may have created a row with the same unique key since disambiguation ran
+        existing = claim_unique([inst])[0] if save else None
+        if existing is not None:
+            inst = existing
+            if self.change.get('extra'):
+                # Merge this source's extra data into the existing row, as an update would
+                self.target = inst
+                inst.change = self
+                inst.extra = self._save_extra()
+                inst.extra_version_id = inst.extra.version_id
+                inst.save()
+        else:
+            if self.change.get('extra'):
+                extra = self._new_extra()
+                extra.save()
+                inst.extra, inst.extra_version_id = extra, extra.version_id
+            if save:
+                inst.save()
         self.target = inst
         return inst
 
@@ -243,20 +530,29 @@ class Change(models.Model):
 
         return change['into']
 
-    def _resolve_change(self):
+    def _new_extra(self):
+        from share.models.base import ExtraData
+        return ExtraData(change=self, data={self.change_set.normalized_data.source.username: self.change['extra']})
+
+    def _save_extra(self):
+        # Add this source's namespace to the target's ExtraData, or to a new one
+        if self.target_id and self.target.extra:
+            extra = self.target.extra
+            extra.change = self
+            extra.data.update({self.change_set.normalized_data.source.username: self.change['extra']})
+        else:
+            extra = self._new_extra()
+        extra.save()
+        return extra
+
+    def _resolve_change(self, save_extra=True):
         change = {}
         for k, v in self.change.items():
             if k == 'extra':
-                if not v:
+                # ChangeSet._save_extras writes ExtraData in bulk
+                if not v or not save_extra:
                     continue
-                if self.target and self.target.extra:
-                    change[k] = self.target.extra
-                else:
-                    from share.models.base import ExtraData
-                    change[k] = ExtraData()
-                change[k].change = self
-                change[k].data.update({self.change_set.normalized_data.source.username: v})
-                change[k].save()
+                change[k] = self._save_extra()
                 change[k + '_version_id'] = change[k].version_id
             elif isinstance(v, dict):
                 inst = self.change_set._resolve_ref(v)
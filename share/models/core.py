@@ -1,7 +1,9 @@
 import datetime
+import json
 import logging
 import random
 import string
+from hashlib import sha256
 
 from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
@@ -17,7 +19,7 @@ from oauth2_provider.models import AccessToken, Application
 
 from osf_oauth2_adapter.apps import OsfOauth2AdapterConfig
 
-from share.models.fields import DateTimeAwareJSONField, ShareURLField
+from share.models.fields import DateTimeAwareJSONEncoder, DateTimeAwareJSONField, ShareURLField
 from share.models.validators import JSONLDValidator
 
 logger = logging.getLogger(__name__)
@@ -177,6 +179,26 @@ def user_post_save(sender, instance, created, **kwargs):
             instance.groups.add(Group.objects.get(name=OsfOauth2AdapterConfig.humans_group_name))
 
 
+class NormalizedDataManager(models.Manager):
+
+    def latest_for(self, source, raw=None):
+        """The queryset of NormalizedData that may supersede each other: the same suid if raw is given, otherwise the same source.
+        """
+        if raw is None:
+            return self.filter(source=source, raw__isnull=True).order_by('-id')
+        return self.filter(source=source, raw__suid_id=raw.suid_id).order_by('-id')
+
+    def store(self, data, source, raw=None, **kwargs):
+        """Create a NormalizedData, unless the last one for the same suid or source holds an identical graph.
+        In which case that one is returned, unchanged, instead.
+        """
+        hash_ = NormalizedData.hash_graph(data)
+        last = self.latest_for(source, raw).first()
+        if last is not None and last.sha256 == hash_:
+            return last
+        return self.create(data=data, source=source, raw=raw, sha256=hash_, **kwargs)
+
+
 class NormalizedData(models.Model):
     id = models.AutoField(primary_key=True)
     created_at = models.DateTimeField(null=True, auto_now_add=True)
@@ -184,6 +206,44 @@ class NormalizedData(models.Model):
     data = DateTimeAwareJSONField(validators=[JSONLDValidator(), ])
     source = models.ForeignKey(settings.AUTH_USER_MODEL)
     tasks = models.ManyToManyField('CeleryProviderTask')
+    # The sha256 of the canonicalized graph, see hash_graph
+    sha256 = models.TextField(null=True, validators=[validators.MaxLengthValidator(64)])
+
+    objects = NormalizedDataManager()
+
+    @staticmethod
+    def hash_graph(data):
+        """Hash a JSON-LD graph regardless of the order of its nodes or the names of its blank nodes.
+
+        Blank node ids are random, so nodes are sorted by their contents with blank references stripped
+        and blank nodes are renamed by their position in that order.
+        """
+        graph = data.get('@graph', [])
+        blank = {node['@id'] for node in graph if str(node['@id']).startswith('_:')}
+
+        def relabel(value, labels):
+            if isinstance(value, list):
+                return [relabel(v, labels) for v in value]
+            if isinstance(value, dict):
+                ret = {k: relabel(v, labels) for k, v in value.items() if k != '@id'}
+                if '@id' in value and (value['@id'] not in blank or value['@id'] in labels):
+                    ret['@id'] = labels.get(value['@id'], value['@id'])
+                return ret
+            return value
+
+        def dumps(value):
+            return json.dumps(value, sort_keys=True, separators=(',', ':'), cls=DateTimeAwareJSONEncoder)
+
+        order = sorted(range(len(graph)), key=lambda i: (dumps(relabel(graph[i], {})), i))
+        labels = {graph[i]['@id']: '_:{}'.format(n) for n, i in enumerate(order) if graph[i]['@id'] in blank}
+
+        canonical = {**data, '@graph': [relabel(graph[i], labels) for i in order]}
+        return sha256(dumps(canonical).encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        if self.sha256 is None:
+            self.sha256 = self.hash_graph(self.data)
+        return super().save(*args, **kwargs)
 
     def __str__(self):
         return '{} created at {}'.format(self.source.get_short_name(), self.created_at)
@@ -19,6 +19,7 @@ from django.db.models.fields.related import lazy_related_operation
 from django.db.models.fields.related import resolve_relation
 from django.db.models.fields.related_descriptors import ManyToManyDescriptor
 from django.db.models.utils import make_model_tuple
+from django.utils import dateparse
 from django.utils.functional import curry
 from django.utils.translation import ugettext_lazy as _
 
@@ -38,23 +39,34 @@ class DateTimeAwareJSONEncoder(DjangoJSONEncoder):
         return super(DateTimeAwareJSONEncoder, self).default(o)
 
 
+# Values are encoded with isoformat, django's regex based parsers handle those.
+# dateutil is kept as a fallback for anything else.
+DECODERS = {
+    'encoded_datetime': lambda value: dateparse.parse_datetime(value) or parser.parse(value),
+    'encoded_date': lambda value: dateparse.parse_date(value) or parser.parse(value).date(),
+    'encoded_time': lambda value: dateparse.parse_time(value) or parser.parse(value).time(),
+    'encoded_decimal': Decimal,
+}
+
+
+def decode_value(value):
+    """Decode a value encoded by DateTimeAwareJSONEncoder. Anything else is returned as is.
+    """
+    if isinstance(value, dict) and 'type' in value:
+        decoder = DECODERS.get(value['type']) if isinstance(value['type'], str) else None
+        if decoder:
+            return decoder(value['value'])
+    return value
+
+
 def decode_datetime_objects(nested_value):
     if isinstance(nested_value, list):
-        return [decode_datetime_objects(item) for item in nested_value]
+        return [decode_datetime_objects(decode_value(item)) for item in nested_value]
     elif isinstance(nested_value, dict):
         for key, value in nested_value.items():
             if isinstance(value, dict) and 'type' in value.keys():
-                if value['type'] == 'encoded_datetime':
-                    nested_value[key] = parser.parse(value['value'])
-                if value['type'] == 'encoded_date':
-                    nested_value[key] = parser.parse(value['value']).date()
-                if value['type'] == 'encoded_time':
-                    nested_value[key] = parser.parse(value['value']).time()
-                if value['type'] == 'encoded_decimal':
-                    nested_value[key] = Decimal(value['value'])
-            elif isinstance(value, dict):
-                nested_value[key] = decode_datetime_objects(value)
-            elif isinstance(value, list):
+                nested_value[key] = decode_value(value)
+            elif isinstance(value, (dict, list)):
                 nested_value[key] = decode_datetime_objects(value)
         return nested_value
     return nested_value
@@ -1,9 +1,17 @@
+import functools
+import operator
+from hashlib import sha256
+
+from django.core.exceptions import FieldDoesNotExist
 from django.db import connections
+from django.db.models import Q
+from django.db.models.fields import AutoField
 from django.db.models.sql import InsertQuery
 from django.db.models.sql.compiler import SQLInsertCompiler
 
 from share.models.fuzzycount import FuzzyCountManager
 from share.models.fuzzycount import FuzzyCountQuerySet
+from share.util import chunked
 
 
 class SQLInsertReturnVersionCompiler(SQLInsertCompiler):
@@ -91,6 +99,151 @@ class ShareObjectManager(FuzzyCountManager):
         return InsertReturnVersionQuerySet(self.model, using=self._db)
 
 
+def _version_field(meta):
+    try:
+        return meta.get_field('version')
+    except FieldDoesNotExist:
+        return None
+
+
+def bulk_insert(objs, using='default', batch_size=500):
+    """INSERT objs, which must share a concrete model, with one statement per batch.
+
+    Sets the primary key and, for versioned models, the version of each obj from the rows the database returns.
+    """
+    if not objs:
+        return
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    meta = objs[0]._meta.concrete_model._meta
+    version = _version_field(meta)
+    fields = [f for f in meta.local_concrete_fields if not isinstance(f, AutoField)]
+    returning = [meta.pk] + ([version] if version else [])
+
+    with connection.cursor() as cursor:
+        for chunk in chunked(objs, size=batch_size):
+            if not chunk:
+                continue
+            cursor.execute('INSERT INTO {table} ({columns}) VALUES {values} RETURNING {returning};'.format(
+                table=qn(meta.db_table),
+                columns=', '.join(qn(f.column) for f in fields),
+                values=', '.join(['({})'.format(', '.join(['%s'] * len(fields)))] * len(chunk)),
+                returning=', '.join(qn(f.column) for f in returning),
+            ), [f.get_db_prep_save(f.pre_save(obj, True), connection) for obj in chunk for f in fields])
+
+            # Postgres returns rows in the order they were given
+            for obj, row in zip(chunk, cursor.fetchall()):
+                for field, value in zip(returning, row):
+                    setattr(obj, field.attname, value)
+                obj._state.adding = False
+                obj._state.db = using
+
+
+def bulk_update(objs, fields, using='default', batch_size=500):
+    """UPDATE the named fields of objs, which must share a concrete model, with one statement per batch.
+
+    Each obj gets its own values. For versioned models, the new version of each obj is set from the rows the database returns.
+    """
+    if not objs:
+        return
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    meta = objs[0]._meta.concrete_model._meta
+    version = _version_field(meta)
+    fields = [meta.get_field(f) for f in fields]
+    columns = [meta.pk] + fields
+    # Values are untyped, make sure postgres compares and assigns them properly
+    placeholder = '({})'.format(', '.join(
+        '%s::{}'.format('integer' if isinstance(f, AutoField) else f.db_type(connection))
+        for f in columns
+    ))
+
+    with connection.cursor() as cursor:
+        for chunk in chunked(objs, size=batch_size):
+            if not chunk:
+                continue
+            cursor.execute('UPDATE {table} SET {assignments} FROM (VALUES {values}) AS "v" ({columns}) WHERE {table}.{pk} = "v".{pk}{returning};'.format(
+                table=qn(meta.db_table),
+                assignments=', '.join('{0} = "v".{0}'.format(qn(f.column)) for f in fields),
+                values=', '.join([placeholder] * len(chunk)),
+                columns=', '.join(qn(f.column) for f in columns),
+                pk=qn(meta.pk.column),
+                returning=' RETURNING {}.{}, {}.{}'.format(qn(meta.db_table), qn(meta.pk.column), qn(meta.db_table), qn(version.column)) if version else '',
+            ), [obj.pk if f is meta.pk else f.get_db_prep_save(f.pre_save(obj, False), connection) for obj in chunk for f in columns])
+
+            if version:
+                versions = dict(cursor.fetchall())
+                for obj in chunk:
+                    setattr(obj, version.attname, versions[obj.pk])
+
+
+def _unique_keys(meta):
+    # Unique fields and unique_together, leaving out the one to one relations every ShareObject has
+    keys = [(f, ) for f in meta.local_concrete_fields if f.unique and not f.primary_key and not f.is_relation]
+    keys.extend(tuple(meta.get_field(name) for name in together) for together in meta.unique_together)
+    return keys
+
+
+def _lock_id(meta, fields, values):
+    key = '{}:{}'.format(meta.db_table, ','.join('{}={!r}'.format(f.column, v) for f, v in zip(fields, values)))
+    return int.from_bytes(sha256(key.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+def unique_lock_ids(model, values):
+    """The advisory lock id of every unique key of model that is fully given by values, a dict of attnames to values.
+    """
+    meta = model._meta.concrete_model._meta
+    keys = ((fields, tuple(values.get(f.attname) for f in fields)) for fields in _unique_keys(meta))
+    return {_lock_id(meta, fields, key) for fields, key in keys if None not in key}
+
+
+def lock_unique(lock_ids, using='default'):
+    """Take a transaction level advisory lock for every id, with a single statement and in sorted order.
+
+    Every lock a transaction needs has to be taken in one call. Locks taken by a later call may be held by another
+    transaction that is waiting on one taken by this call, which deadlocks.
+    """
+    if not lock_ids:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(k) FROM (SELECT unnest(%s::bigint[]) AS k ORDER BY k) AS locks;', [sorted(lock_ids)])
+
+
+def claim_unique(objs, using='default', lock=True):
+    """Find the rows that already hold the unique keys of objs, which must be unsaved and share a concrete model.
+
+    Unless lock is False, the keys are locked first with lock_unique. Any other transaction creating the same keys
+    through here has then committed or rolled back, so the lookup sees its rows. Callers that make more than one call per
+    transaction must pass lock=False and lock all of their keys up front instead, see lock_unique.
+    Returns the existing row, or None, for each obj.
+    """
+    if not objs:
+        return []
+    meta = objs[0]._meta.concrete_model._meta
+    values = {
+        fields: [tuple(getattr(obj, f.attname) for f in fields) for obj in objs]
+        for fields in _unique_keys(meta)
+    }
+    if not any(None not in v for vals in values.values() for v in vals):
+        return [None] * len(objs)
+
+    if lock:
+        lock_unique({_lock_id(meta, fields, v) for fields, vals in values.items() for v in vals if None not in v}, using=using)
+
+    found = {}
+    for fields, vals in values.items():
+        vals = [v for v in vals if None not in v]
+        if not vals:
+            continue
+        query = functools.reduce(operator.or_, (Q(**{f.attname: x for f, x in zip(fields, v)}) for v in vals))
+        for row in meta.model._base_manager.using(using).filter(query):
+            found[fields, tuple(getattr(row, f.attname) for f in fields)] = row
+
+    return [
+        next((found[fields, vals[i]] for fields, vals in values.items() if (fields, vals[i]) in found), None)
+        for i in range(len(objs))
+    ]
+
 # ShareObjectManager = InsertReturnVersionQuerySet.as_manager()
 # ShareObjectManager.
 
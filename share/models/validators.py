@@ -18,12 +18,113 @@ def is_valid_jsonld(value):
     raise Exception('Deprecated; use JSONLDValidator')
 
 
+JSON_TYPES = {
+    'array': lambda v: isinstance(v, list),
+    'boolean': lambda v: isinstance(v, bool),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'null': lambda v: v is None,
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'object': lambda v: isinstance(v, dict),
+    'string': lambda v: isinstance(v, str),
+}
+
+# Keywords that have no bearing on whether or not an instance is valid
+ANNOTATION_KEYWORDS = {'$schema', 'title', 'description', 'definitions'}
+
+
+def _never(value):
+    return False
+
+
+def compile_schema(schema, format_checker=None, root=None):
+    """Compile a Draft4 schema into a function that returns True if the given instance is valid.
+
+    Only the subset of Draft4 used by SHARE's schemas is supported. Schemas using any other keyword
+    compile to a function that always returns False, deferring to a full Draft4Validator.
+    The compiled function bails out at the first failure and never builds error messages.
+    """
+    root = root or schema
+
+    if '$ref' in schema:
+        if not schema['$ref'].startswith('#/'):
+            return _never
+        target = root
+        for part in schema['$ref'][2:].split('/'):
+            target = target[part]
+        return compile_schema(target, format_checker, root)
+
+    checks = []
+    for keyword, arg in schema.items():
+        if keyword in ANNOTATION_KEYWORDS or keyword in ('properties', 'required'):
+            continue
+        elif keyword == 'type':
+            types = tuple(JSON_TYPES[t] for t in ([arg] if isinstance(arg, str) else arg))
+            checks.append(types[0] if len(types) == 1 else lambda v, types=types: any(t(v) for t in types))
+        elif keyword == 'enum':
+            checks.append(lambda v, enum=arg: v in enum)
+        elif keyword == 'minLength':
+            checks.append(lambda v, length=arg: not isinstance(v, str) or len(v) >= length)
+        elif keyword == 'format':
+            if format_checker is not None:
+                checks.append(lambda v, format=arg: format_checker.conforms(v, format))
+        elif keyword == 'items' and isinstance(arg, dict):
+            checks.append(lambda v, item=compile_schema(arg, format_checker, root): not isinstance(v, list) or all(item(x) for x in v))
+        elif keyword == 'oneOf':
+            checks.append(lambda v, subs=tuple(compile_schema(s, format_checker, root) for s in arg): sum(1 for s in subs if s(v)) == 1)
+        elif keyword == 'additionalProperties':
+            continue
+        else:
+            return _never
+
+    if 'properties' in schema or 'required' in schema or 'additionalProperties' in schema:
+        checks.append(_compile_object(schema, format_checker, root))
+
+    checks = tuple(checks)
+
+    def compiled(value):
+        for check in checks:
+            if not check(value):
+                return False
+        return True
+
+    return compiled
+
+
+def _compile_object(schema, format_checker, root):
+    required = tuple(schema.get('required', ()))
+    properties = {k: compile_schema(v, format_checker, root) for k, v in schema.get('properties', {}).items()}
+    additional = schema.get('additionalProperties', True)
+    if isinstance(additional, dict):
+        additional = compile_schema(additional, format_checker, root)
+
+    def compiled(value):
+        if not isinstance(value, dict):
+            return True
+        for key in required:
+            if key not in value:
+                return False
+        for key, val in value.items():
+            check = properties.get(key)
+            if check is None:
+                if additional is True:
+                    continue
+                if additional is False or not additional(val):
+                    return False
+            elif not check(val):
+                return False
+        return True
+
+    return compiled
+
+
 @deconstructible
 class JSONLDValidator:
 
     __schema_cache = {}
+    __compiled_cache = {}
     with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jsonld-schema.json')) as fobj:
         jsonld_schema = Draft4Validator(ujson.load(fobj))
+    compiled_jsonld_schema = staticmethod(compile_schema(jsonld_schema.schema))
 
     db_type_map = {
         'text': 'string',
@@ -37,6 +138,36 @@ class JSONLDValidator:
         self.__check_existence = check_existence
 
     def __call__(self, value):
+        # The compiled validators only answer "valid or not". Anything they reject is
+        # run back through the Draft4 validators to build the exact error message.
+        if self.is_valid(value):
+            return
+        self.validate(value)
+
+    def is_valid(self, value):
+        if not isinstance(value, dict) or not JSONLDValidator.compiled_jsonld_schema(value) or not value['@graph']:
+            return False
+
+        refs, nodes = set(), set()
+        for node in value['@graph']:
+            model = apps.app_configs['share'].models.get(node['@type'].lower())
+            if model is None or (model._meta.proxied_children and model == model._meta.concrete_model):
+                return False
+            if not self.compiled_validator_for(model)(node):
+                return False
+
+            for key, val in node.items():
+                if isinstance(val, dict) and key != 'extra' and val['@id'].startswith('_:'):
+                    refs.add((val['@id'], val['@type'].lower()))
+
+            if not isinstance(node['@id'], str):
+                return False
+            if node['@id'].startswith('_:'):
+                nodes.add((node['@id'], node['@type'].lower()))
+
+        return not (refs - nodes)
+
+    def validate(self, value):
         try:
             JSONLDValidator.jsonld_schema.validate(value)
         except exceptions.ValidationError as e:
@@ -157,6 +288,13 @@ class JSONLDValidator:
 
         return JSONLDValidator.__schema_cache.setdefault(model, Draft4Validator(schema, format_checker=draft4_format_checker))
 
+    def compiled_validator_for(self, model):
+        try:
+            return JSONLDValidator.__compiled_cache[model]
+        except KeyError:
+            pass
+        return JSONLDValidator.__compiled_cache.setdefault(model, compile_schema(self.validator_for(model).schema, format_checker=draft4_format_checker))
+
     def allowed_fields_for_model(self, model):
         excluded = {'id', 'type', 'sources', 'changes', 'same_as', 'extra'}
         fields = model._meta.get_fields()
@@ -9,3 +9,11 @@ def post_migrate_load_sources(sender, **kwargs):
     except ProgrammingError:
         return
     management.call_command('loadsources')
+
+
+def post_migrate_clear_caches(sender, **kwargs):
+    # Content types may have been created or renumbered
+    from share.util import IDObfuscator
+    from share.util import SubjectTaxonomy
+    IDObfuscator.clear_cache()
+    SubjectTaxonomy.clear_cache()
@@ -4,6 +4,7 @@ import functools
 import logging
 import random
 import threading
+import time
 
 import pendulum
 import celery
@@ -18,6 +19,7 @@ from django.db import transaction
 from django.utils import timezone
 
 from share.change import ChangeGraph
+from share.disambiguation import DisambiguationCache
 from share.harvest.exceptions import HarvesterConcurrencyError, HarvesterDisabledError
 from share.models import HarvestLog
 from share.models import RawDatum, NormalizedData, ChangeSet, CeleryTask, CeleryProviderTask, ShareUser, SourceConfig
@@ -68,7 +70,7 @@ class LoggedTask(celery.Task):
             defaults=self.log_values(),
         )
 
-        self.do_run(*self.args, **self.kwargs)
+        ret = self.do_run(*self.args, **self.kwargs)
 
         # Clean up at the end to avoid keeping anything in memory
         # This is not in a finally as it may mess up sentry's exception reporting
@@ -76,6 +78,8 @@ class LoggedTask(celery.Task):
             if hasattr(self.context, attr):
                 delattr(self.context, attr)
 
+        return ret
+
     def on_retry(self, exc, task_id, args, kwargs, einfo):
         CeleryTask.objects.filter(uuid=task_id).update(status=CeleryTask.STATUS.retried)
 
@@ -387,17 +391,76 @@ class DisambiguatorTask(LoggedTask):
 
         try:
             with transaction.atomic():
-                cg = ChangeGraph(self.normalized.data['@graph'], namespace=self.normalized.source.username)
-                cg.process()
-                cs = ChangeSet.objects.from_graph(cg, self.normalized.id)
-                if cs and (self.source.is_robot or self.source.is_trusted):
-                    # TODO: verify change set is not overwriting user created object
-                    cs.accept()
+                self.disambiguate(self.normalized)
         except Exception as e:
             logger.info('Failed make JSON patches for NormalizedData %s with exception %s. Retrying...', self.normalized.id, e)
             raise self.retry(countdown=10, exc=e)
 
         logger.info('Finished make JSON patches for NormalizedData %s by %s at %s', self.normalized.id, self.started_by, datetime.datetime.utcnow().isoformat())
+        logger.debug('Disambiguation cache: %(hits)d hits, %(misses)d misses (%(hit_rate).2f), %(size)d keys', DisambiguationCache.stats())
+
+    @staticmethod
+    def disambiguate(normalized):
+        last_accepted = NormalizedData.objects.latest_for(normalized.source, normalized.raw).filter(
+            id__lte=normalized.id,
+            changeset__status=ChangeSet.STATUS.accepted,
+        ).values_list('sha256', flat=True).first()
+
+        if normalized.sha256 and last_accepted == normalized.sha256:
+            logger.info('NormalizedData %s is identical to the last accepted graph for its suid or source, skipping...', normalized.id)
+            return
+
+        cg = ChangeGraph(normalized.data['@graph'], namespace=normalized.source.username)
+        cg.process()
+        cs = ChangeSet.objects.from_graph(cg, normalized.id)
+        if cs and (normalized.source.is_robot or normalized.source.is_trusted):
+            # TODO: verify change set is not overwriting user created object
+            cs.accept()
+
+
+class BatchDisambiguatorTask(LoggedTask):
+    """Make changes for many NormalizedData at once, sharing warmed caches between them.
+
+    Each document is disambiguated in a transaction of its own, so a failure only rolls back that document and
+    locks are never held across documents. Failed documents are handed off to DisambiguatorTask, which retries
+    them on their own. Returns the outcome and duration of each document.
+    """
+
+    def setup(self, normalized_ids, *args, **kwargs):
+        self.normalized = NormalizedData.objects.select_related('source', 'raw').in_bulk(normalized_ids)
+
+    def do_run(self, normalized_ids, *args, **kwargs):
+        # Load all relevant ContentTypes in a single query
+        ContentType.objects.get_for_models(*apps.get_models('share'), for_concrete_models=False)
+
+        logger.info('%s started make JSON patches for %d NormalizedData at %s', self.started_by, len(normalized_ids), datetime.datetime.utcnow().isoformat())
+
+        results, failed = [], []
+        for normalized_id in normalized_ids:
+            if normalized_id not in self.normalized:
+                logger.warning('NormalizedData %s does not exist, skipping...', normalized_id)
+                continue
+
+            start = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    DisambiguatorTask.disambiguate(self.normalized[normalized_id])
+            except Exception as e:
+                logger.info('Failed make JSON patches for NormalizedData %s with exception %s. Retrying on its own...', normalized_id, e)
+                failed.append(normalized_id)
+                status = 'failed'
+            else:
+                status = 'succeeded'
+            results.append({'normalized_id': normalized_id, 'status': status, 'duration': time.perf_counter() - start})
+            logger.debug('Made JSON patches for NormalizedData %(normalized_id)s: %(status)s in %(duration).3fs', results[-1])
+
+        for normalized_id in failed:
+            DisambiguatorTask().apply_async((self.started_by.id, normalized_id), countdown=10)
+
+        logger.info('Finished make JSON patches for %d NormalizedData by %s at %s, %d failed', len(results), self.started_by, datetime.datetime.utcnow().isoformat(), len(failed))
+        logger.debug('Disambiguation cache: %(hits)d hits, %(misses)d misses (%(hit_rate).2f), %(size)d keys', DisambiguationCache.stats())
+
+        return results
 
 
 class BotTask(AppTask):
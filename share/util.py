@@ -1,6 +1,8 @@
+import collections
 from collections import OrderedDict
 import os
 import re
+import time
 import yaml
 
 
@@ -35,27 +37,86 @@ class IDObfuscator:
     # Match HHHHH-HHH-HHH Where H is any hexidecimal digit
     ID_RE = re.compile(r'([0-9A-Fa-f]{2})([0-9A-Fa-f]{3})-([0-9A-Fa-f]{3})-([0-9A-Fa-f]{3})')
 
+    # Process level tables of content type id -> model and concrete model -> content type id
+    # Filled with a single query the first time either is needed, see IDObfuscator.clear_cache
+    _models = {}
+    _content_type_ids = {}
+
     @classmethod
-    def encode(cls, instance):
-        return cls.encode_id(instance.id, type(instance))
+    def clear_cache(cls):
+        cls._models.clear()
+        cls._content_type_ids.clear()
 
     @classmethod
-    def encode_id(cls, pk, model):
+    def _fill_cache(cls):
         from django.contrib.contenttypes.models import ContentType
 
-        model_id = ContentType.objects.get_for_model(model).id
+        for content_type in ContentType.objects.all():
+            model = content_type.model_class()
+            if model is None:
+                continue  # Stale content type
+            cls._models[content_type.id] = model
+            cls._content_type_ids[model] = content_type.id
+
+    @classmethod
+    def _model_for(cls, model_id):
+        try:
+            return cls._models[model_id]
+        except KeyError:
+            pass
+
+        cls._fill_cache()
+        if model_id not in cls._models:
+            # Not a known content type, let the ORM raise the appropriate error
+            from django.contrib.contenttypes.models import ContentType
+            return ContentType.objects.get_for_id(model_id).model_class()
+        return cls._models[model_id]
+
+    @classmethod
+    def _content_type_id_for(cls, model):
+        model = model._meta.concrete_model
+        try:
+            return cls._content_type_ids[model]
+        except KeyError:
+            pass
+
+        cls._fill_cache()
+        if model not in cls._content_type_ids:
+            from django.contrib.contenttypes.models import ContentType
+            return ContentType.objects.get_for_model(model).id
+        return cls._content_type_ids[model]
+
+    @classmethod
+    def _encode(cls, model_id, pk):
         encoded = '{:09X}'.format(pk * cls.NUM % cls.MOD)
         return '{:02X}{}-{}-{}'.format(model_id, encoded[:3], encoded[3:6], encoded[6:])
 
     @classmethod
-    def decode(cls, id):
-        from django.contrib.contenttypes.models import ContentType
+    def encode(cls, instance):
+        return cls.encode_id(instance.id, type(instance))
+
+    @classmethod
+    def encode_id(cls, pk, model):
+        return cls._encode(cls._content_type_id_for(model), pk)
 
+    @classmethod
+    def encode_many(cls, pks, model):
+        """Encode an iterable of primary keys of `model`, returns a list of encoded ids"""
+        model_id = cls._content_type_id_for(model)
+        return [cls._encode(model_id, pk) for pk in pks]
+
+    @classmethod
+    def decode(cls, id):
         match = cls.ID_RE.match(id)
         if not match:
             raise InvalidID(id)
         model_id, *pks = match.groups()
-        return ContentType.objects.get(pk=int(model_id, 16)).model_class(), int(''.join(pks), 16) * cls.MOD_INV % cls.MOD
+        return cls._model_for(int(model_id, 16)), int(''.join(pks), 16) * cls.MOD_INV % cls.MOD
+
+    @classmethod
+    def decode_many(cls, ids):
+        """Decode an iterable of encoded ids, returns a list of (model, pk) tuples"""
+        return [cls.decode(id) for id in ids]
 
     @classmethod
     def decode_id(cls, id):
@@ -74,6 +135,23 @@ class IDObfuscator:
     def resolver(cls, self, args, context, info):
         return cls.resolve(args.get('id', ''))
 
+    @classmethod
+    def load_many(cls, ids):
+        """Load the instances for an iterable of encoded ids using a single query per model.
+
+        Returns a dict of encoded id -> instance. Ids that do not point to an existing object are omitted.
+        """
+        ids = list(ids)
+        by_model = {}
+        for id, (model, pk) in zip(ids, cls.decode_many(ids)):
+            by_model.setdefault(model, {})[pk] = id
+
+        loaded = {}
+        for model, pks in by_model.items():
+            for pk, instance in model.objects.in_bulk(list(pks.keys())).items():
+                loaded[pks[pk]] = instance
+        return loaded
+
     @classmethod
     def load(cls, id, *args):
         model, pk = cls.decode(id)
@@ -85,54 +163,223 @@ class IDObfuscator:
             raise
 
 
+class ModelInfo:
+    """Precomputed facts about a model's place in SHARE's (typed) model hierarchy.
+
+    Computed once per model per process. Use ModelInfo.get(model) or ModelInfo.for_type('person').
+    """
+
+    _cache = {}
+    _type_cache = {}
+
+    def __init__(self, model):
+        self.model = model
+        self.concrete_model = model._meta.concrete_model
+        # Used to decide which of two related models is the more specific one
+        self.depth = len(model.mro())
+        # All typedmodels types that are this model or a subclass of it, empty for non-typed models
+        self.types = tuple(model.get_types()) if hasattr(model, 'get_types') else ()
+        # This model and any proxy models it is a subclass of
+        self.proxy_parents = tuple(
+            m for m in model.__mro__
+            if isinstance(m, type) and issubclass(m, self.concrete_model) and m._meta.proxy
+        )
+
+    @classmethod
+    def get(cls, model):
+        try:
+            return cls._cache[model]
+        except KeyError:
+            return cls._cache.setdefault(model, cls(model))
+
+    @classmethod
+    def for_type(cls, type):
+        try:
+            return cls._type_cache[type]
+        except KeyError:
+            pass
+        from django.apps import apps
+        return cls._type_cache.setdefault(type, cls.get(apps.get_model('share', type)))
+
+    def __repr__(self):
+        return '<{}({})>'.format(self.__class__.__name__, self.model._meta.label_lower)
+
+
+class SubjectTaxonomy:
+    """The complete Subject taxonomy, loaded once per process.
+
+    Subjects are immutable and only ever added in bulk by `addsubjects`,
+    so they can be looked up by name and their parents followed without touching the database.
+    """
+
+    # Unknown names reload the taxonomy, at most once per this many seconds
+    RELOAD_INTERVAL = 60
+    # Subjects are indexed along with at most this many levels of ancestors
+    EXPAND_DEPTH = 3
+
+    _by_name = {}
+    _by_pk = {}
+    _loaded_at = None
+
+    @classmethod
+    def clear_cache(cls):
+        cls._by_name, cls._by_pk = {}, {}
+        cls._loaded_at = None
+
+    @classmethod
+    def _load(cls):
+        from share.models import Subject
+        subjects = list(Subject.objects.all())
+        cls._by_name = {subject.name: subject for subject in subjects}
+        cls._by_pk = {subject.id: subject for subject in subjects}
+        cls._loaded_at = time.monotonic()
+
+    @classmethod
+    def get(cls, name):
+        """The Subject named name or None. Every caller shares the same instance, which must not be modified."""
+        if cls._loaded_at is None:
+            cls._load()
+        try:
+            return cls._by_name[name]
+        except KeyError:
+            pass
+        # Subjects may have been added by another process since the taxonomy was loaded
+        if time.monotonic() - cls._loaded_at < cls.RELOAD_INTERVAL:
+            return None
+        cls._load()
+        return cls._by_name.get(name)
+
+    @classmethod
+    def pk_for(cls, name):
+        subject = cls.get(name)
+        return subject.id if subject else None
+
+    @classmethod
+    def ancestors(cls, name):
+        """The names of every subject above name, closest first"""
+        subject = cls.get(name)
+        ancestors = []
+        while subject is not None and subject.parent_id is not None:
+            subject = cls._by_pk.get(subject.parent_id)
+            if subject is not None:
+                ancestors.append(subject.name)
+        return ancestors
+
+    @classmethod
+    def expand(cls, names):
+        """The sorted, distinct names of the given subjects and their ancestors, up to EXPAND_DEPTH levels up"""
+        expanded = set()
+        for name in names:
+            expanded.add(name)
+            expanded.update(cls.ancestors(name)[:cls.EXPAND_DEPTH])
+        return sorted(expanded)
+
+
 class CyclicalDependency(Exception):
     pass
 
 
 class TopographicalSorter:
-    """Sort a list of nodes topographically, so a node is always preceded by its dependencies"""
+    """Sort a list of nodes topographically, so a node is always preceded by its dependencies
+
+    Uses Kahn's algorithm. There is no recursion and every node and dependency is visited once,
+    so very large or very deep graphs are sorted in linear time.
+    """
 
     # `nodes`: Iterable of objects
     # `dependencies`: Callable that takes a single argument (a node) and returns an iterable of its dependent nodes (or keys, if `key` is given)
     # `key`: Callable that takes a single argument (a node) and returns a unique key. If omitted, nodes will be compared for equality directly.
     def __init__(self, nodes, dependencies, key=None):
-        self.__sorted = []
         self.__nodes = list(nodes)
-        self.__visited = set()
-        self.__visiting = set()
         self.__dependencies = dependencies
         self.__key = key
-        self.__node_map = {key(n): n for n in nodes} if key else None
+        self.__node_map = {key(n): n for n in self.__nodes} if key else None
 
     def sorted(self):
-        if not self.__nodes:
-            return self.__sorted
+        # key -> node, in the order they were discovered
+        nodes = {}
+        # key -> number of dependencies that have not been sorted yet
+        waiting_on = {}
+        # key -> keys of the nodes that depend on it
+        dependents = {}
+
+        # Dependencies that were not explicitly given are sorted as well
+        queue = collections.deque(self.__nodes)
+        while queue:
+            node = queue.popleft()
+            key = self.__key(node) if self.__key else node
+            if key in nodes:
+                continue
+
+            nodes[key] = node
+            waiting_on[key] = 0
+            for k in self.__dependencies(node):
+                if k is None:
+                    continue
+                waiting_on[key] += 1
+                dependents.setdefault(k, []).append(key)
+                if k not in nodes:
+                    queue.append(self.__get_node(k))
+
+        ready = collections.deque(key for key, count in waiting_on.items() if count == 0)
+        sorted = []
+        while ready:
+            key = ready.popleft()
+            sorted.append(nodes[key])
+            for dependent in dependents.get(key, ()):
+                waiting_on[dependent] -= 1
+                if waiting_on[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(sorted) < len(nodes):
+            cyclic = {key for key, count in waiting_on.items() if count}
+            raise CyclicalDependency(next(iter(cyclic)), cyclic)
+
+        return sorted
 
-        while self.__nodes:
-            n = self.__nodes.pop(0)
-            self.__visit(n)
+    def __get_node(self, key):
+        return self.__node_map[key] if self.__node_map else key
 
-        return self.__sorted
 
-    def __visit(self, node):
-        key = self.__key(node) if self.__key else node
-        if key in self.__visiting:
-            raise CyclicalDependency(key, self.__visiting)
+class OrderedSet:
+    """A set that remembers insertion order and supports indexing.
 
-        if key in self.__visited:
-            return
+    Membership checks, additions and removals are O(1).
+    """
 
-        self.__visiting.add(key)
-        for k in self.__dependencies(node):
-            if k is not None:
-                self.__visit(self.__get_node(k))
+    def __init__(self, iterable=()):
+        self.__items = OrderedDict.fromkeys(iterable)
+        self.__sequence = None
 
-        self.__visited.add(key)
-        self.__sorted.append(node)
-        self.__visiting.remove(key)
+    def add(self, item):
+        if item not in self.__items:
+            self.__items[item] = None
+            self.__sequence = None
 
-    def __get_node(self, key):
-        return self.__node_map[key] if self.__node_map else key
+    def remove(self, item):
+        del self.__items[item]
+        self.__sequence = None
+
+    def discard(self, item):
+        if item in self.__items:
+            self.remove(item)
+
+    def __getitem__(self, index):
+        if self.__sequence is None:
+            self.__sequence = tuple(self.__items)
+        return self.__sequence[index]
+
+    def __contains__(self, item):
+        return item in self.__items
+
+    def __iter__(self):
+        return iter(self.__items)
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, list(self.__items))
 
 
 class ModelGenerator:
@@ -179,8 +426,31 @@ class ModelGenerator:
         return field_class(*field_spec.get('args', []), **field_spec.get('kwargs', {}))
 
 
+def hashable(val):
+    """val as something that can be used as a dict key.
+
+    Dicts and lists, including ones nested in tuples, are converted to tuples.
+    Anything that is already hashable is returned as is, without walking it.
+    """
+    if isinstance(val, dict):
+        if isinstance(val, OrderedDict):
+            items = val.items()
+        else:
+            items = sorted(val.items(), key=lambda x: x[0])
+        return tuple((k, hashable(v)) for k, v in items)
+    if isinstance(val, list):
+        return tuple(hashable(v) for v in val)
+    if isinstance(val, tuple):
+        try:
+            hash(val)
+        except TypeError:
+            return tuple(hashable(v) for v in val)
+    return val
+
+
 class DictHashingDict:
     # A wrapper around dicts that can have dicts as keys
+    # Prefer a plain dict and `hashable` when the key can be computed once
 
     def __init__(self):
         self.__inner = {}
@@ -204,14 +474,7 @@ class DictHashingDict:
         return self._hash(key) in self.__inner
 
     def _hash(self, val):
-        if isinstance(val, dict):
-            if not isinstance(val, OrderedDict):
-                val = tuple((k, self._hash(v)) for k, v in sorted(val.items(), key=lambda x: x[0]))
-            else:
-                val = tuple((k, self._hash(v)) for k, v in val.items())
-        if isinstance(val, (list, tuple)):
-            val = tuple(self._hash(v) for v in val)
-        return val
+        return hashable(val)
 
 
 def chunked(iterable, size=25, fail_fast=False):
@@ -9,9 +9,12 @@ from elasticsearch.exceptions import ConnectionError as ElasticConnectionError
 from share.util import IDObfuscator
 
 from bots.elasticsearch import tasks
+from bots.elasticsearch import util
 from bots.elasticsearch.bot import ElasticSearchBot
+from bots.elasticsearch.models import IndexQueueEntry
 
 from tests import factories
+from tests.share.models.factories import AgentWorkRelationFactory
 
 
 @pytest.fixture
@@ -115,3 +118,69 @@ class TestIndexSource:
 
         with pytest.raises(NotFoundError):
             elastic.es_client.get(index=elastic.es_index, doc_type='sources', id=source.name)
+
+
+class TestPipelined:
+
+    def test_shards(self):
+        assert util.shards([5, 3, 1, 4, 2], 2) == [[1, 2], [3, 4], [5]]
+        assert util.shards([], 2) == []
+
+    def test_yields_in_shard_order(self):
+        assert list(util.pipelined(lambda shard: (x * 10 for x in shard), util.shards(range(250), 100))) == [x * 10 for x in range(250)]
+
+    def test_raises_fetch_errors(self):
+        def fetch(shard):
+            if shard[0] > 0:
+                raise ValueError(shard)
+            yield from shard
+
+        with pytest.raises(ValueError):
+            list(util.pipelined(fetch, [[0], [1], [2]]))
+
+
+@pytest.mark.django_db
+class TestIndexQueue:
+
+    def queued(self, model_name):
+        return set(IndexQueueEntry.objects.filter(model_name=model_name).values_list('object_id', flat=True))
+
+    def test_writes_are_queued(self):
+        relation = AgentWorkRelationFactory()
+
+        assert self.queued('creativework') == {relation.creative_work_id}
+        assert self.queued('agent') == {relation.agent_id}
+
+    def test_renaming_an_agent_queues_its_works(self):
+        relation = AgentWorkRelationFactory()
+        IndexQueueEntry.objects.all().delete()
+
+        relation.agent.administrative_change(name='Someone Else')
+
+        assert self.queued('agent') == {relation.agent_id}
+        assert self.queued('creativework') == {relation.creative_work_id}
+
+    def test_claim(self):
+        works = [factories.AbstractCreativeWorkFactory() for _ in range(3)]
+        IndexQueueEntry.objects.create(model_name='creativework', object_id=works[0].id)
+        last = IndexQueueEntry.objects.last_id()
+
+        # Every entry for the oldest work is claimed, however many times it was queued
+        assert IndexQueueEntry.objects.claim(1, last, model_names=['creativework']) == {'creativework': [works[0].id]}
+        assert self.queued('creativework') == {works[1].id, works[2].id}
+
+        IndexQueueEntry.objects.create(model_name='creativework', object_id=works[0].id)
+        claimed = IndexQueueEntry.objects.claim(500, last, model_names=['creativework'])
+
+        # Entries newer than last are left for the next run
+        assert claimed == {'creativework': [works[1].id, works[2].id]}
+        assert self.queued('creativework') == {works[0].id}
+
+    def test_requeue(self):
+        works = [factories.AbstractCreativeWorkFactory() for _ in range(2)]
+        claimed = IndexQueueEntry.objects.claim(500, IndexQueueEntry.objects.last_id(), model_names=['creativework'])
+        assert self.queued('creativework') == set()
+
+        IndexQueueEntry.objects.requeue(claimed)
+
+        assert self.queued('creativework') == {work.id for work in works}
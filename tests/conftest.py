@@ -18,6 +18,7 @@ from share.models import Article, Institution
 from share.models import ShareUser
 from share.models import Harvester, Transformer, Source, SourceConfig, SourceUniqueIdentifier
 from share.change import ChangeGraph
+from share.util import SubjectTaxonomy
 
 
 @pytest.fixture
@@ -41,6 +42,12 @@ def apply_test_settings(settings):
     settings.CELERY_ALWAYS_EAGER = True
 
 
+@pytest.fixture(autouse=True)
+def clear_subject_taxonomy():
+    # Subjects are rolled back between tests, the taxonomy has to follow
+    SubjectTaxonomy.clear_cache()
+
+
 @pytest.fixture
 def trusted_user():
     user = ShareUser(username='trusted_tester', is_trusted=True)
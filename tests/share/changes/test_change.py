@@ -1,12 +1,18 @@
+import factory
 import pytest
 
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from share import models
 from share.change import ChangeGraph
+from share.change import ChangeNode
 from share.util import IDObfuscator
 
+from tests.share.models import factories
+
 
 @pytest.fixture
 def create_graph():
@@ -178,6 +184,190 @@ class TestChangeSet:
         assert models.Preprint.objects.filter(agent_relations__agent=john_doe).count() == 1
         assert models.Preprint.objects.filter(agent_relations__agent=john_doe).first().title == 'All About Cats'
 
+    @pytest.mark.django_db
+    def test_accept_sets_versions(self, normalized_data_id, create_graph_dependencies):
+        changed = models.ChangeSet.objects.from_graph(create_graph_dependencies, normalized_data_id).accept()
+        person, preprint, creator = changed
+
+        for inst in changed:
+            assert inst.version_id == type(inst).objects.get(pk=inst.pk).version_id
+            assert inst.sources.filter(pk=models.NormalizedData.objects.get(pk=normalized_data_id).source_id).exists()
+
+        creator.refresh_from_db()
+        assert creator.agent_version_id == person.version_id
+        assert creator.creative_work_version_id == preprint.version_id
+
+    @pytest.mark.django_db
+    def test_accept_queries_do_not_grow(self, normalized_data_id):
+        counts = []
+        # The first round warms up ContentType's cache
+        for size in (1, 5, 50):
+            graph = ChangeGraph([
+                {'@id': '_:{}'.format(i), '@type': 'tag', 'name': 'Tag {} of {}'.format(i, size)}
+                for i in range(size)
+            ])
+            change_set = models.ChangeSet.objects.from_graph(graph, normalized_data_id)
+            with CaptureQueriesContext(connection) as ctx:
+                change_set.accept()
+            counts.append(len(ctx))
+
+        assert counts[1] == counts[2]
+
+    @pytest.mark.django_db
+    def test_accept_resolves_refs_in_bulk(self, normalized_data_id):
+        counts = []
+        # The first round warms up ContentType's cache
+        for size in (1, 3, 10):
+            tags = [factories.TagFactory(name=factory.Sequence('bulk tag {}'.format)) for _ in range(size)]
+            graph = ChangeGraph([{'@id': '_:work', '@type': 'preprint', 'title': 'Tagged {} times'.format(size)}] + [
+                {'@id': IDObfuscator.encode(tag), '@type': 'tag'} for tag in tags
+            ] + [{
+                '@id': '_:through{}'.format(i),
+                '@type': 'throughtags',
+                'tag': {'@id': IDObfuscator.encode(tag), '@type': 'tag'},
+                'creative_work': {'@id': '_:work', '@type': 'preprint'},
+            } for i, tag in enumerate(tags)])
+            change_set = models.ChangeSet.objects.from_graph(graph, normalized_data_id)
+            with CaptureQueriesContext(connection) as ctx:
+                change_set.accept()
+            counts.append(len(ctx))
+
+            assert set(models.Preprint.objects.get(title='Tagged {} times'.format(size)).tags.all()) == set(tags)
+
+        assert counts[1] == counts[2]
+
+    @pytest.mark.django_db
+    def test_from_graph_queries_do_not_grow(self, normalized_data_id):
+        counts = []
+        # The first round warms up ContentType's cache
+        for size in (1, 3, 10):
+            works = [factories.PreprintFactory(extra=factories.ExtraDataFactory(data={'test': {'views': 1}})) for _ in range(size)]
+            graph = ChangeGraph([{
+                '@id': IDObfuscator.encode(work),
+                '@type': 'preprint',
+                'title': 'Retitled {} times'.format(size),
+                'extra': {'views': 2},
+            } for work in works], namespace='test')
+
+            with CaptureQueriesContext(connection) as ctx:
+                change_set = models.ChangeSet.objects.from_graph(graph, normalized_data_id)
+            counts.append(len(ctx))
+
+            assert [c.change for c in change_set.changes.all()] == [{'title': 'Retitled {} times'.format(size), 'extra': {'views': 2}}] * size
+
+        assert counts[1] == counts[2]
+
+    @pytest.mark.django_db
+    def test_from_graph_diffs_each_node_once(self, normalized_data_id, monkeypatch):
+        works = [factories.PreprintFactory(extra=factories.ExtraDataFactory(data={'test': {'views': 1}})) for _ in range(3)]
+        graph = ChangeGraph([{
+            '@id': IDObfuscator.encode(work),
+            '@type': 'preprint',
+            'title': work.title if i else 'Retitled',
+            'extra': {'views': 1},
+        } for i, work in enumerate(works)], namespace='test')
+
+        diffed = []
+        diff = ChangeNode._diff
+        monkeypatch.setattr(ChangeNode, '_diff', lambda self: diffed.append(self) or diff(self))
+
+        change_set = models.ChangeSet.objects.from_graph(graph, normalized_data_id)
+
+        assert change_set.changes.count() == 1
+        assert sorted(diffed, key=lambda n: n.id) == sorted(graph.nodes, key=lambda n: n.id)
+
+    @pytest.mark.django_db
+    def test_accept_merges_extra_namespaces(self, normalized_data_id):
+        with_extra = factories.PreprintFactory(extra=factories.ExtraDataFactory(data={'other': {'views': 1}}))
+        without_extra = factories.PreprintFactory(extra=None)
+        namespace = models.NormalizedData.objects.get(id=normalized_data_id).source.username
+
+        graph = ChangeGraph([{
+            '@id': IDObfuscator.encode(work),
+            '@type': 'preprint',
+            'extra': {'views': 2},
+        } for work in (with_extra, without_extra)], namespace=namespace)
+        change_set = models.ChangeSet.objects.from_graph(graph, normalized_data_id)
+        change_set.accept()
+
+        for work in (with_extra, without_extra):
+            work = models.Preprint.objects.get(id=work.id)
+            assert work.extra.data[namespace] == {'views': 2}
+            assert work.extra_version_id == work.extra.version_id
+            assert work.extra.change.change_set == change_set
+
+        assert models.Preprint.objects.get(id=with_extra.id).extra.data['other'] == {'views': 1}
+
+    @pytest.mark.django_db
+    def test_accept_uses_concurrently_created_rows(self, normalized_data_id):
+        graph = ChangeGraph([{
+            '@id': '_:tag',
+            '@type': 'tag',
+            'name': 'racing',
+        }, {
+            '@id': '_:through',
+            '@type': 'throughtags',
+            'tag': {'@id': '_:tag', '@type': 'tag'},
+            'creative_work': {'@id': '_:work', '@type': 'preprint'},
+        }, {
+            '@id': '_:identifier',
+            '@type': 'workidentifier',
+            'uri': 'http://example.com/racing',
+            'creative_work': {'@id': '_:work', '@type': 'preprint'},
+        }, {
+            '@id': '_:work',
+            '@type': 'preprint',
+            'title': 'A Race',
+        }])
+        graph.process()
+        change_set = models.ChangeSet.objects.from_graph(graph, normalized_data_id)
+
+        # Created by another task after this change set was disambiguated
+        tag = factories.TagFactory(name='racing')
+        identifier = factories.WorkIdentifierFactory(uri='http://example.com/racing')
+
+        ret = change_set.accept()
+
+        assert tag in ret
+        assert identifier in ret
+        assert models.Tag.objects.filter(name='racing').count() == 1
+        assert models.WorkIdentifier.objects.filter(uri='http://example.com/racing').count() == 1
+        assert list(models.Preprint.objects.get(title='A Race').tags.all()) == [tag]
+
+    @pytest.mark.django_db
+    def test_accept_merges_extra_into_concurrently_created_rows(self, normalized_data_id):
+        namespace = models.NormalizedData.objects.get(id=normalized_data_id).source.username
+        graph = ChangeGraph([{
+            '@id': '_:tag',
+            '@type': 'tag',
+            'name': 'racing',
+            'extra': {'color': 'red'},
+        }, {
+            '@id': '_:other',
+            '@type': 'tag',
+            'name': 'sailing',
+            'extra': {'color': 'blue'},
+        }], namespace=namespace)
+        graph.process()
+        change_set = models.ChangeSet.objects.from_graph(graph, normalized_data_id)
+
+        # Created by another task after this change set was disambiguated
+        with_extra = factories.TagFactory(name='racing', extra=factories.ExtraDataFactory(data={'other': {'color': 'green'}}))
+        without_extra = factories.TagFactory(name='sailing', extra=None)
+
+        assert change_set.accept() == [with_extra, without_extra]
+
+        for tag, color in ((with_extra, 'red'), (without_extra, 'blue')):
+            change = change_set.changes.get(node_id='_:tag' if tag == with_extra else '_:other')
+            tag = models.Tag.objects.get(id=tag.id)
+            assert change.target == tag
+            assert tag.change == change
+            assert tag.version.change == change
+            assert tag.extra.data[namespace] == {'color': color}
+            assert tag.extra_version_id == tag.extra.version_id
+
+        assert models.Tag.objects.get(id=with_extra.id).extra.data['other'] == {'color': 'green'}
+
     @pytest.mark.django_db
     def test_can_delete_work(self, john_doe, normalized_data_id):
         graph = ChangeGraph([{
@@ -1,6 +1,10 @@
+import copy
+import tracemalloc
+
 import pytest
 
 from share.change import ChangeGraph
+from share.models import Institution, Organization
 from share.change import UnresolvableReference
 from share.util import CyclicalDependency
 
@@ -41,6 +45,21 @@ class TestChangeNode:
         assert 'extra' not in node.attrs
         assert node.extra == {'likes': ['cats']}
 
+    def test_model_cache_invalidated(self):
+        node = ChangeGraph([{
+            '@id': '_:1234',
+            '@type': 'organization',
+            'name': 'Center for Open Science',
+        }]).nodes[0]
+
+        assert node.type == 'organization'
+        assert node.model is Organization
+
+        node._type = 'institution'
+
+        assert node.type == 'institution'
+        assert node.model is Institution
+
     # def test_mergeaction(self):
     #     node = ChangeNode.from_jsonld({
     #         '@id': '_:1234',
@@ -121,6 +140,27 @@ class TestChangeGraph:
         assert graph.nodes[1].id == '_:5678'
         assert len(graph.nodes[1].related()) == 1
 
+    def test_does_not_mutate_data(self):
+        data = [{
+            '@id': '_:5678',
+            '@type': 'Contributor',
+            'agent': {'@id': '_:1234', '@type': 'Person'},
+            'extra': {'likes': ['cats']},
+        }, {
+            '@id': '_:1234',
+            '@type': 'Person',
+            'given_name': 'Doe',
+            'family_name': 'Jane',
+            'work_relations': [{'@id': '_:5678', '@type': 'Contributor'}],
+        }]
+        expected = copy.deepcopy(data)
+
+        graph = ChangeGraph(data)
+
+        assert data == expected
+        assert len(graph.nodes[1].related()) == 1
+        assert graph.nodes[1].extra == {'likes': ['cats']}
+
     def test_topological_sort_many_to_many(self):
         graph = ChangeGraph([{
             '@id': '_:91011',
@@ -184,6 +224,32 @@ class TestChangeGraph:
         assert graph.nodes[0].id == '_:1234'
         assert graph.nodes[1].id == '_:5678'
 
+    def test_related_index_follows_changes(self):
+        graph = ChangeGraph([{
+            '@id': '_:5678',
+            '@type': 'contributor',
+            'agent': {'@id': '_:1234', '@type': 'person'}
+        }, {
+            '@id': '_:1234',
+            '@type': 'person',
+            'name': 'Jane Doe',
+        }])
+        contributor, person = graph.get('_:5678', 'contributor'), graph.get('_:1234', 'person')
+
+        assert contributor.related('agent').related is person
+        assert person.related('work_relations') == (contributor.related('agent'), )
+
+        replacement = graph.create('_:9999', 'person', {'name': 'Jane Doe'})
+        graph.replace(person, replacement)
+
+        assert contributor.related('agent').related is replacement
+        assert replacement.related('work_relations') == (contributor.related('agent'), )
+
+        graph.remove(contributor)
+
+        assert replacement.related() == ()
+        assert replacement.related('work_relations') == ()
+
     def test_detect_cyclic(self):
         with pytest.raises(CyclicalDependency):
             ChangeGraph([{
@@ -216,6 +282,49 @@ class TestChangeGraph:
             }]).process()
         assert e.value.args == (('_:1234', 'person'),)
 
+    def test_benchmark_memory(self, benchmark):
+        data = []
+        for i in range(25000):
+            data.append({'@id': '_:p{}'.format(i), '@type': 'person', 'name': 'Person {}'.format(i)})
+            data.append({
+                '@id': '_:i{}'.format(i),
+                '@type': 'agentidentifier',
+                'uri': 'http://example.com/{}'.format(i),
+                'agent': {'@id': '_:p{}'.format(i), '@type': 'person'},
+            })
+
+        def traced(func):
+            tracemalloc.start()
+            try:
+                return func(), tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+
+        graph, allocated = benchmark.pedantic(traced, args=(lambda: ChangeGraph(data), ), rounds=1, iterations=1)
+        assert len(graph.nodes) == 50000
+
+        objs = list(graph.nodes) + list({edge for edges in graph.relations.values() for edge in edges})
+        assert not any(hasattr(obj, '__dict__') for obj in objs)
+
+        # Copy every node and edge into either its own class or an ordinary, dict backed, one holding the same attributes
+        def copy(unslotted):
+            copies = []
+            for obj in objs:
+                clone = object.__new__(unslotted or type(obj))
+                for name in type(obj).__slots__:
+                    if hasattr(obj, name):
+                        setattr(clone, name, getattr(obj, name))
+                copies.append(clone)
+            return copies
+
+        _, slotted = traced(lambda: copy(None))
+        _, baseline = traced(lambda: copy(type('Unslotted', (), {})))
+
+        benchmark.extra_info['bytes_per_node'] = allocated // len(graph.nodes)
+        benchmark.extra_info['bytes_saved_per_object'] = (baseline - slotted) // len(objs)
+
+        assert slotted < baseline
+
     # def test_external_reference(self):
     #     ChangeGraph.from_jsonld({
     #         '@graph': [{
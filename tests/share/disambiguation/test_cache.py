@@ -0,0 +1,61 @@
+import pytest
+
+from share import models
+from share.change import ChangeGraph
+from share.disambiguation import DisambiguationCache
+from share.models import ChangeSet
+
+from tests.share.normalize.factories import *
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    DisambiguationCache.clear()
+    DisambiguationCache.hits = DisambiguationCache.misses = 0
+
+
+@pytest.mark.django_db
+class TestDisambiguationCache:
+
+    @pytest.fixture
+    def initial(self, Graph, normalized_data_id):
+        graph = ChangeGraph(Graph(Preprint(0, identifiers=[WorkIdentifier(1)], tags=[Tag(name='Science')])))
+        graph.process()
+        ChangeSet.objects.from_graph(graph, normalized_data_id).accept()
+        return graph
+
+    def test_hits(self, initial, Graph):
+        first = ChangeGraph(Graph(Preprint(0, identifiers=[WorkIdentifier(1)], tags=[Tag(name='Science')])))
+        first.process()
+        assert DisambiguationCache.hits == 0
+        assert DisambiguationCache.misses > 0
+
+        second = ChangeGraph(Graph(Preprint(0, identifiers=[WorkIdentifier(1)], tags=[Tag(name='Science')])))
+        second.process()
+        assert DisambiguationCache.hits > 0
+        assert [n.instance for n in first.nodes] == [n.instance for n in second.nodes]
+        assert all(n.instance for n in second.nodes)
+
+    def test_invalidate(self, initial, Graph):
+        ChangeGraph(Graph(Tag(name='Science'))).process()
+        assert DisambiguationCache.stats()['size'] == 1
+
+        DisambiguationCache.invalidate()
+        assert DisambiguationCache.stats()['size'] == 0
+
+    def test_other_workers_invalidate(self, initial, Graph):
+        ChangeGraph(Graph(Tag(name='Science'))).process()
+        DisambiguationCache._generation = -1
+
+        DisambiguationCache.sync()
+        assert DisambiguationCache.stats()['size'] == 0
+
+    @pytest.mark.parametrize('model, fields, affected', [
+        (models.WorkIdentifier, {'uri'}, True),
+        (models.WorkIdentifier, {'creative_work'}, False),
+        (models.Tag, {'name'}, True),
+        (models.Preprint, {'title'}, False),
+        (models.Preprint, {'type'}, True),
+    ])
+    def test_is_affected_by(self, model, fields, affected):
+        assert DisambiguationCache.is_affected_by(model, fields) is affected
@@ -2,6 +2,7 @@ import pytest
 
 from share import models
 from share.change import ChangeGraph
+from share.disambiguation import GraphDisambiguator
 from share.models import ChangeSet
 
 from tests.share.models.factories import NormalizedDataFactory
@@ -114,3 +115,19 @@ class TestDisambiguation:
         cg = ChangeGraph(Graph(*initial))
         cg.process()
         assert ChangeSet.objects.from_graph(cg, NormalizedDataFactory().id) is None
+
+    def test_batched_matches_unbatched(self, Graph):
+        initial_cg = ChangeGraph(Graph(*initial))
+        initial_cg.process()
+        ChangeSet.objects.from_graph(initial_cg, NormalizedDataFactory().id).accept()
+
+        results = []
+        for batch in (True, False):
+            Graph.discarded_ids.clear()
+            cg = ChangeGraph(Graph(*initial))
+            cg.normalize()
+            GraphDisambiguator(batch=batch).find_instances(cg)
+            results.append({(n.id, n.type): n.instance for n in cg.nodes})
+
+        assert results[0] == results[1]
+        assert all(results[0].values())
@@ -42,6 +42,12 @@ class TestPruneChangeGraph:
         result = [n.serialize() for n in graph.nodes]
         assert result == Graph(*output)
 
+    def test_cascading_merges(self, Graph):
+        # Merging the tags makes the throughtags duplicates of each other
+        graph = ChangeGraph(Graph(Preprint(0, tags=[Tag(name='Science'), Tag(name='Science')])))
+        GraphDisambiguator().prune(graph)
+        assert sorted(n.type for n in graph.nodes) == ['preprint', 'tag', 'throughtags']
+
     @pytest.mark.django_db
     @pytest.mark.parametrize('input', [
         [
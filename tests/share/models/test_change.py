@@ -1,8 +1,6 @@
 import pytest
 import pendulum
 
-from django.db import IntegrityError
-
 from share.models import Tag
 from share.models import Person
 from share.models import AbstractCreativeWork
@@ -238,8 +236,8 @@ class TestChangeGraph:
 
         assert jane_doe.given_name == 'John'
 
-    def test_unique_violation_raises(self, change_factory, change_ids):
-        Tag.objects.create(name='mycooltag', change_id=change_ids.get())
+    def test_unique_violation_uses_existing_row(self, change_factory, change_ids):
+        tag = Tag.objects.create(name='mycooltag', change_id=change_ids.get())
 
         change_set = change_factory.from_graph({
             '@graph': [{
@@ -249,8 +247,17 @@ class TestChangeGraph:
             }]
         }, disambiguate=False)
 
-        with pytest.raises(IntegrityError):
-            change_set.accept()
+        assert change_set.accept() == [tag]
+
+        change = change_set.changes.get()
+        assert change.target == tag
+        assert change_set.status == ChangeSet.STATUS.accepted
+
+        # Nothing was written to the existing row
+        assert Tag.objects.count() == 1
+        assert Tag.objects.get().version_id == tag.version_id
+        assert Tag.objects.get().change_id == tag.change_id
+        assert tag.versions.count() == 1
 
     def test_date_updated_update(self, change_ids, change_factory, all_about_anteaters):
         """
@@ -2,7 +2,7 @@ import datetime as dt
 import json
 from decimal import Decimal
 
-from share.models.fields import DateTimeAwareJSONEncoder, decode_datetime_objects
+from share.models.fields import DateTimeAwareJSONEncoder, DateTimeAwareJSONField, decode_datetime_objects, decode_value
 
 
 class TestDateTimeAwareJSONField:
@@ -63,3 +63,14 @@ class TestDateTimeAwareJSONField:
         json_string = json.dumps(self.json_list_data, cls=DateTimeAwareJSONEncoder)
         json_data = decode_datetime_objects(json.loads(json_string))
         assert json_data == self.json_list_data, 'Nope'
+
+    def test_to_python(self):
+        json_data = DateTimeAwareJSONField().to_python(json.loads(json.dumps(self.json_dict_data, cls=DateTimeAwareJSONEncoder)))
+        assert json_data['list_of_things'][2][1]['sample_decimal'] == Decimal('10.259')
+        assert json_data == self.json_dict_data, 'Nope'
+
+    def test_decode_offsets(self):
+        value = dt.datetime(2017, 4, 1, 12, 30, 15, 123, tzinfo=dt.timezone(dt.timedelta(hours=-4)))
+        assert decode_value({'type': 'encoded_datetime', 'value': value.isoformat()}) == value
+        assert decode_value({'type': 'encoded_datetime', 'value': 'April 1st, 2017'}) == dt.datetime(2017, 4, 1)
+        assert decode_value({'type': 'something_else', 'value': '1'}) == {'type': 'something_else', 'value': '1'}
@@ -0,0 +1,54 @@
+from hashlib import sha256
+
+import pytest
+
+from share.models import NormalizedData, RawDatum
+
+
+def graph(tag_id='_:1', through_id='_:2', work_id='_:3', title='A Title', reverse=False):
+    nodes = [
+        {'@id': tag_id, '@type': 'tag', 'name': 'A Tag'},
+        {'@id': through_id, '@type': 'throughtags', 'tag': {'@id': tag_id, '@type': 'tag'}, 'creative_work': {'@id': work_id, '@type': 'preprint'}},
+        {'@id': work_id, '@type': 'preprint', 'title': title},
+    ]
+    return {'@graph': nodes[::-1] if reverse else nodes}
+
+
+class TestHashGraph:
+
+    def test_ignores_blank_ids_and_order(self):
+        assert NormalizedData.hash_graph(graph()) == NormalizedData.hash_graph(graph('_:a', '_:b', '_:c', reverse=True))
+
+    def test_detects_changes(self):
+        assert NormalizedData.hash_graph(graph()) != NormalizedData.hash_graph(graph(title='Another Title'))
+
+    def test_keeps_concrete_ids(self):
+        assert NormalizedData.hash_graph(graph(work_id='ABC-123')) != NormalizedData.hash_graph(graph(work_id='DEF-456'))
+
+
+@pytest.mark.django_db
+class TestNormalizedDataStore:
+
+    def test_hashes_on_save(self, share_user):
+        nd = NormalizedData.objects.create(source=share_user, data=graph())
+        assert nd.sha256 == NormalizedData.hash_graph(graph())
+
+    def test_dedupes_by_suid(self, share_user, suid):
+        raw = RawDatum.objects.create(suid=suid, datum='1', sha256=sha256(b'1').hexdigest())
+        first = NormalizedData.objects.store(graph(), share_user, raw=raw)
+        second = NormalizedData.objects.store(graph('_:a', '_:b', '_:c'), share_user, raw=RawDatum.objects.create(suid=suid, datum='2', sha256=sha256(b'2').hexdigest()))
+
+        assert first == second
+        assert NormalizedData.objects.count() == 1
+        # The existing row is left as it was
+        assert NormalizedData.objects.get().raw == raw
+
+    def test_dedupes_by_source(self, share_user):
+        assert NormalizedData.objects.store(graph(), share_user) == NormalizedData.objects.store(graph(), share_user)
+
+    def test_only_dedupes_latest(self, share_user):
+        first = NormalizedData.objects.store(graph(), share_user)
+        second = NormalizedData.objects.store(graph(title='Another Title'), share_user)
+        third = NormalizedData.objects.store(graph(), share_user)
+
+        assert len({first.id, second.id, third.id}) == 3
@@ -17,7 +17,7 @@ class TestGraph:
         node = graph.create(None, 'tag', {'name': 'Foo'})
 
         assert len(graph.nodes) == 1
-        assert graph.nodes == [node]
+        assert list(graph.nodes) == [node]
         assert graph.get(node.id, node.type) is node
         assert node.graph is graph
         assert graph.nodes[0] is node
@@ -109,7 +109,7 @@ class TestGraph:
 
         graph.remove(throughtag)
 
-        assert graph.nodes == [tag]
+        assert list(graph.nodes) == [tag]
         assert tag.related() == tuple()
         assert len(graph.relations) == 1
 
@@ -0,0 +1,46 @@
+import pytest
+
+from django.core.management import call_command
+
+from share import models
+
+from tests.share.models import factories
+
+
+@pytest.mark.django_db
+class TestCompactVersions:
+
+    def update(self, obj, times):
+        for i in range(times):
+            obj.change = factories.ChangeFactory()
+            obj.name = '{} {}'.format(obj.name, i)
+            obj.save()
+
+    def test_keeps_latest_and_referenced(self):
+        tag = factories.TagFactory()
+        pinned = tag.version
+        factories.ThroughTagsFactory(tag=tag)
+        self.update(tag, 4)
+        tag.refresh_from_db()
+        latest = list(models.Tag.VersionModel.objects.filter(persistent_id=tag.id).order_by('-date_modified', '-id').values_list('id', flat=True)[:2])
+
+        call_command('compactversions', 'tag', days=0, keep=2)
+
+        assert set(tag.versions.values_list('id', flat=True)) == {pinned.id, *latest}
+        assert tag.version_id in latest
+
+    def test_retention(self):
+        tag = factories.TagFactory()
+        self.update(tag, 3)
+
+        call_command('compactversions', 'tag', days=1, keep=1)
+
+        assert tag.versions.count() == 4
+
+    def test_dry_run(self):
+        tag = factories.TagFactory()
+        self.update(tag, 3)
+
+        call_command('compactversions', 'tag', days=0, keep=1, dry_run=True)
+
+        assert tag.versions.count() == 4
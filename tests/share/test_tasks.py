@@ -0,0 +1,62 @@
+import pytest
+
+from share import models
+from share.tasks import BatchDisambiguatorTask, DisambiguatorTask
+
+from tests.share.models.factories import NormalizedDataFactory
+
+
+@pytest.mark.django_db
+class TestBatchDisambiguatorTask:
+
+    def test_failures_are_isolated(self, trusted_user, share_user, monkeypatch):
+        retried = []
+        monkeypatch.setattr(DisambiguatorTask, 'apply_async', lambda self, args, **kwargs: retried.append(args))
+
+        good = NormalizedDataFactory(source=trusted_user, data={'@graph': [{'@id': '_:1', '@type': 'tag', 'name': 'Batched'}]})
+        bad = NormalizedDataFactory(source=trusted_user, data={'@graph': [{'@id': '_:2', '@type': 'throughtags', 'tag': {'@id': '_:3', '@type': 'tag'}}]})  # Unresolvable reference
+        other = NormalizedDataFactory(source=trusted_user, data={'@graph': [{'@id': '_:4', '@type': 'tag', 'name': 'Also Batched'}]})
+
+        results = BatchDisambiguatorTask().apply((share_user.id, [good.id, bad.id, other.id]), throw=True).get()
+
+        assert [(r['normalized_id'], r['status']) for r in results] == [
+            (good.id, 'succeeded'),
+            (bad.id, 'failed'),
+            (other.id, 'succeeded'),
+        ]
+        assert all(r['duration'] >= 0 for r in results)
+        assert retried == [(share_user.id, bad.id)]
+
+        # Tag names are lowercased by the normalizer
+        assert models.Tag.objects.filter(name__in=['batched', 'also batched']).count() == 2
+        assert not models.ChangeSet.objects.filter(normalized_data=bad).exists()
+
+    def test_missing_ids_are_skipped(self, trusted_user, share_user, monkeypatch):
+        retried = []
+        monkeypatch.setattr(DisambiguatorTask, 'apply_async', lambda self, args, **kwargs: retried.append(args))
+
+        normalized = NormalizedDataFactory(source=trusted_user, data={'@graph': [{'@id': '_:1', '@type': 'tag', 'name': 'Present'}]})
+
+        results = BatchDisambiguatorTask().apply((share_user.id, [normalized.id + 1, normalized.id]), throw=True).get()
+
+        assert [(r['normalized_id'], r['status']) for r in results] == [(normalized.id, 'succeeded')]
+        assert retried == []
+
+
+@pytest.mark.django_db
+class TestDisambiguatorTask:
+
+    def test_skips_unchanged_graphs(self, trusted_user, share_user):
+        data = {'@graph': [{'@id': '_:1', '@type': 'tag', 'name': 'Unchanged'}]}
+
+        first = models.NormalizedData.objects.create(source=trusted_user, data=data)
+        DisambiguatorTask().apply((share_user.id, first.id), throw=True)
+        assert models.ChangeSet.objects.filter(normalized_data=first, status=models.ChangeSet.STATUS.accepted).count() == 1
+
+        # Without the skip, the second graph would change the tag's name back
+        models.Tag.objects.get().administrative_change(name='changed elsewhere')
+
+        second = models.NormalizedData.objects.create(source=trusted_user, data=data)
+        DisambiguatorTask().apply((share_user.id, second.id), throw=True)
+        assert not models.ChangeSet.objects.filter(normalized_data=second).exists()
+        assert models.Tag.objects.get().name == 'changed elsewhere'
@@ -0,0 +1,31 @@
+from collections import OrderedDict
+
+import pytest
+
+from share.util import hashable, DictHashingDict
+
+
+class TestHashable:
+
+    @pytest.mark.parametrize('value, expected', [
+        (1, 1),
+        ('a', 'a'),
+        ((1, 2), (1, 2)),
+        ([1, [2, 3]], (1, (2, 3))),
+        ({'b': 1, 'a': [2]}, (('a', (2, )), ('b', 1))),
+        (OrderedDict([('b', 1), ('a', 2)]), (('b', 1), ('a', 2))),
+        (('a', {'@id': '_:1', '@type': 'tag'}), ('a', (('@id', '_:1'), ('@type', 'tag')))),
+    ])
+    def test_hashable(self, value, expected):
+        assert hashable(value) == expected
+        hash(hashable(value))
+
+    def test_hashable_returns_same_object(self):
+        value = (('name', 'Science'), ('uri', 'http://example.com'))
+        assert hashable(value) is value
+
+    def test_dict_hashing_dict(self):
+        d = DictHashingDict()
+        d[{'@id': '_:1', '@type': 'tag'}] = 'tag'
+        assert d[{'@type': 'tag', '@id': '_:1'}] == 'tag'
+        assert {'@id': '_:1', '@type': 'tag'} in d
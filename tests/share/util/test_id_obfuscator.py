@@ -0,0 +1,39 @@
+import pytest
+
+from share import models
+from share.util import IDObfuscator, InvalidID
+
+from tests.share.models import factories
+
+
+@pytest.mark.django_db
+class TestIDObfuscator:
+
+    def test_round_trip(self):
+        tag = factories.TagFactory()
+        assert IDObfuscator.decode(IDObfuscator.encode(tag)) == (models.Tag, tag.id)
+
+    def test_proxy_models_use_concrete_type(self):
+        work = factories.PreprintFactory()
+        assert IDObfuscator.encode(work) == IDObfuscator.encode_id(work.id, models.AbstractCreativeWork)
+
+    def test_many(self):
+        tags = [factories.TagFactory() for _ in range(5)]
+        encoded = IDObfuscator.encode_many([t.id for t in tags], models.Tag)
+
+        assert encoded == [IDObfuscator.encode(t) for t in tags]
+        assert IDObfuscator.decode_many(encoded) == [(models.Tag, t.id) for t in tags]
+        assert IDObfuscator.load_many(encoded) == dict(zip(encoded, tags))
+
+    def test_decode_many_invalid(self):
+        with pytest.raises(InvalidID):
+            IDObfuscator.decode_many(['Foo'])
+
+    def test_no_queries_once_cached(self, django_assert_num_queries):
+        tag = factories.TagFactory()
+        encoded = IDObfuscator.encode(tag)
+
+        with django_assert_num_queries(0):
+            for _ in range(10):
+                assert IDObfuscator.decode(encoded) == (models.Tag, tag.id)
+                assert IDObfuscator.encode(tag) == encoded
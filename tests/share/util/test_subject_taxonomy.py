@@ -0,0 +1,52 @@
+import pytest
+
+from share import models
+from share.util import SubjectTaxonomy
+
+
+@pytest.mark.django_db
+class TestSubjectTaxonomy:
+
+    @pytest.fixture(autouse=True)
+    def subjects(self):
+        models.Subject.objects.bulk_create([models.Subject(id=1, name='Life Sciences')])
+        models.Subject.objects.bulk_create([models.Subject(id=2, name='Zoology', parent_id=1)])
+        models.Subject.objects.bulk_create([models.Subject(id=3, name='Felines', parent_id=2)])
+
+    def test_get(self, django_assert_num_queries):
+        SubjectTaxonomy.get('Life Sciences')
+        with django_assert_num_queries(0):
+            subject = SubjectTaxonomy.get('Felines')
+        assert (subject.id, subject.name, subject.parent_id) == (3, 'Felines', 2)
+
+    def test_missing(self):
+        assert SubjectTaxonomy.get('Canines') is None
+
+    def test_get_is_cached(self):
+        assert SubjectTaxonomy.get('Felines') is SubjectTaxonomy.get('Felines')
+        assert SubjectTaxonomy.get('Felines') == models.Subject.objects.get(name='Felines')
+
+    def test_reloads_new_subjects(self, monkeypatch):
+        monkeypatch.setattr(SubjectTaxonomy, 'RELOAD_INTERVAL', 0)
+        assert SubjectTaxonomy.get('Canines') is None
+        models.Subject.objects.bulk_create([models.Subject(id=4, name='Canines', parent_id=2)])
+        assert SubjectTaxonomy.get('Canines').id == 4
+
+    def test_reloads_are_rate_limited(self, django_assert_num_queries):
+        assert SubjectTaxonomy.get('Canines') is None
+        with django_assert_num_queries(0):
+            assert SubjectTaxonomy.get('Canines') is None
+
+    def test_ancestors(self):
+        assert SubjectTaxonomy.ancestors('Felines') == ['Zoology', 'Life Sciences']
+        assert SubjectTaxonomy.ancestors('Life Sciences') == []
+
+    def test_expand(self):
+        assert SubjectTaxonomy.expand(['Felines', 'Zoology']) == ['Felines', 'Life Sciences', 'Zoology']
+
+    def test_expand_depth(self):
+        models.Subject.objects.bulk_create([models.Subject(id=4, name='Big Cats', parent_id=3)])
+        models.Subject.objects.bulk_create([models.Subject(id=5, name='Lions', parent_id=4)])
+
+        assert SubjectTaxonomy.ancestors('Lions') == ['Big Cats', 'Felines', 'Zoology', 'Life Sciences']
+        assert SubjectTaxonomy.expand(['Lions']) == ['Big Cats', 'Felines', 'Lions', 'Zoology']
@@ -0,0 +1,35 @@
+import pytest
+
+from share.util import CyclicalDependency
+from share.util import TopographicalSorter
+
+
+class TestTopographicalSorter:
+
+    def test_dependencies_first(self):
+        deps = {'a': ('b', 'c'), 'b': ('c', ), 'c': ()}
+        assert TopographicalSorter(['a', 'b', 'c'], dependencies=lambda n: deps[n]).sorted() == ['c', 'b', 'a']
+
+    def test_keys(self):
+        nodes = [{'id': 1, 'deps': (2, )}, {'id': 2, 'deps': (None, )}]
+        result = TopographicalSorter(nodes, dependencies=lambda n: n['deps'], key=lambda n: n['id']).sorted()
+        assert [n['id'] for n in result] == [2, 1]
+
+    def test_implicit_dependencies(self):
+        deps = {'a': ('b', ), 'b': ()}
+        assert TopographicalSorter(['a'], dependencies=lambda n: deps[n]).sorted() == ['b', 'a']
+
+    @pytest.mark.parametrize('deps', [
+        {'a': ('a', )},
+        {'a': ('b', ), 'b': ('a', )},
+        {'a': ('b', ), 'b': ('c', ), 'c': ('a', ), 'd': ()},
+    ])
+    def test_cyclic(self, deps):
+        with pytest.raises(CyclicalDependency):
+            TopographicalSorter(sorted(deps), dependencies=lambda n: deps[n]).sorted()
+
+    def test_deep_chain(self):
+        # Deeper than the default recursion limit
+        nodes = list(range(50000))
+        result = TopographicalSorter(nodes, dependencies=lambda n: (n + 1, ) if n + 1 < len(nodes) else ()).sorted()
+        assert result == list(reversed(nodes))
@@ -259,6 +259,10 @@ class TestJSONLDValidator:
         else:
             assert message is None, 'No exception was raised. Expecting {}'.format(message)
 
+    @pytest.mark.parametrize('data, message', [(case['in'], case['out']) for case in CASES])
+    def test_compiled_validator(self, data, message):
+        assert JSONLDValidator().is_valid(data) is (message is None)
+
     # @pytest.mark.parametrize('data, message', [(case['in'], case['out']) for case in CASES])
     # def test_benchmark_validator(self, benchmark, data, message):
     #     benchmark(self.test_validator, data, message)